@@ -1,2 +1,3 @@
 from .auth import auth_middleware
-from .acl import acl_middleware
\ No newline at end of file
+from .acl import acl_middleware
+from .middleware import auth_acl_middleware
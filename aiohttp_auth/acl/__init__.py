@@ -1,3 +1,11 @@
-from .acl import acl_middleware, get_permitted
-from .acl import get_user_groups
-from .decorators import acl_required
\ No newline at end of file
+from .acl import acl_middleware, get_permitted, invalidate_groups, setup_acl
+from .acl import get_user_groups, invalidate_user_groups
+from .acl import get_permitted_many, get_user_group_mask
+from .bitmask import BitmaskACL, BitRegistry, default_registry
+from .compiled import CompiledACL
+from .resource import Resource
+from .context_factory import ContextFactory, context_factory
+from .groups_cache import GroupsCache
+from .single_flight import SingleFlight
+from .decorators import acl_required, ACLRequirement
+from .routes import compile_route_acls, setup_route_acls, RoutePermissions
@@ -1,13 +1,26 @@
 import itertools
 from aiohttp import web
 from ..auth import get_auth
+from ..instrumentation import clock
+from ..state import STATE_KEY, UNRESOLVED, ACLSettings, get_state
 from ..permissions import Permission, Group
+from .bitmask import BitmaskACL, default_registry
+from .compiled import CompiledACL
+from .context_factory import ContextFactory
+from .resource import Resource
+from .single_flight import SingleFlight
 
 
-GROUPS_KEY = 'aiohttp_auth.acl.callback'
+"""Key used to store the groups cache in the application object"""
+GROUPS_CACHE_KEY = 'aiohttp_auth.acl.groups_cache'
 
+"""Key used to store a tuple of the groups, registry, registry generation and
+group mask computed by get_user_group_mask() in the request object"""
+GROUP_MASK_KEY = 'aiohttp_auth.acl.group_mask'
 
-def acl_middleware(callback):
+
+def acl_middleware(callback, cache=None, coalesce=False, observer=None,
+                   new_style=False):
     """Returns a aiohttp_auth.acl middleware factory for use by the aiohttp
     application object.
 
@@ -18,15 +31,36 @@ def acl_middleware(callback):
             explicit permissions, or None to explicitly forbid this particular
             user_id. Note that the user_id passed may be None if no
             authenticated user exists.
+        cache: Optional GroupsCache object used to cache the results of the
+            callback across requests. Cached entries can be discarded with
+            invalidate_groups(), once the cache is registered in the
+            application with setup_acl().
+        coalesce: If true, concurrent requests for the same user_id share a
+            single call to the callback (see SingleFlight). If a cache is
+            also passed, only cache misses are coalesced.
+        observer: Optional instrumentation.Observer object, which is passed
+            the duration and outcome of the groups callback and
+            get_permitted() calls.
+        new_style: If true, returns a new style middleware (see
+            auth_middleware) rather than a middleware factory.
 
     Returns:
         A aiohttp middleware factory.
     """
-    async def _acl_middleware_factory(app, handler):
+    prepare = _acl_prepare(_wrap_callback(callback, cache, coalesce), observer)
+
+    async def _middleware(request, handler):
+        prepare(get_state(request))
+        return await handler(request)
 
+    if new_style:
+        # Same marker as set by aiohttp's web.middleware decorator
+        _middleware.__middleware_version__ = 1
+        return _middleware
+
+    async def _acl_middleware_factory(app, handler):
         async def _middleware_handler(request):
-            # Save the policy in the request
-            request[GROUPS_KEY] = callback
+            prepare(get_state(request))
 
             # Call the next handler in the chain
             return await handler(request)
@@ -36,37 +70,164 @@ def acl_middleware(callback):
     return _acl_middleware_factory
 
 
+def _wrap_callback(callback, cache, coalesce):
+    if coalesce:
+        callback = SingleFlight().wrap(callback)
+    if cache is not None:
+        callback = cache.wrap(callback)
+
+    return callback
+
+
+def _acl_prepare(callback, observer):
+    """Returns a function saving the acl_middleware state in the AuthState of
+    a request"""
+    settings = ACLSettings(callback, observer)
+
+    def _prepare(state):
+        state.acl = settings
+
+    return _prepare
+
+
+def setup_acl(app, cache):
+    """Registers the GroupsCache passed to acl_middleware (or
+    auth_acl_middleware) in the application, so that invalidate_groups() can
+    find it.
+
+    Must be called while the application is set up, before it starts
+    handling requests, as the application state should not be changed once
+    it has started.
+
+    Args:
+        app: aiohttp Application object
+        cache: GroupsCache object passed to the middleware.
+    """
+    app[GROUPS_CACHE_KEY] = cache
+
+
+def invalidate_groups(app, user_id):
+    """Discards the groups cached across requests for user_id.
+
+    Should be called when the group membership of a user changes. Does
+    nothing if no cache was registered in the application with setup_acl().
+
+    Args:
+        app: aiohttp Application object
+        user_id: The user_id whose groups should be discarded.
+    """
+    cache = app.get(GROUPS_CACHE_KEY)
+    if cache is not None:
+        cache.invalidate(user_id)
+
+
 async def get_user_groups(request):
     """Returns the groups that the user in this request has access to.
 
     This function gets the user id from the auth.get_auth function, and passes
-    it to the ACL callback function to get the groups.
+    it to the ACL callback function to get the groups. The groups are cached
+    in the request, and reused by later calls until remember or forget is
+    called (which change the user_id returned by auth.get_auth), or
+    invalidate_user_groups() is called.
 
     Args:
         request: aiohttp Request object
 
     Returns:
         If the ACL callback function returns None, this function returns None.
-        Otherwise this function returns the sequence of group permissions
+        Otherwise this function returns a frozenset of the group permissions
         provided by the callback, plus the Everyone group. If user_id is not
         None, the AuthnticatedUser group and the user_id are added to the
-        groups returned by the function
+        groups returned by the function. The frozenset is shared by every
+        call for the request, so callers wanting to modify the groups must
+        copy it.
 
     Raises:
         RuntimeError: If the ACL middleware is not installed
     """
-    acl_callback = request.get(GROUPS_KEY)
-    if acl_callback is None:
+    state = request.get(STATE_KEY)
+    if state is None or state.acl is None:
         raise RuntimeError('acl_middleware not installed')
 
     user_id = await get_auth(request)
-    groups = await acl_callback(user_id)
+
+    # remember() and forget() discard the groups, as they change the user_id
+    groups = state.groups
+    if groups is not UNRESOLVED:
+        return groups
+
+    acl_callback, observer = state.acl
+    if observer is None:
+        groups = await acl_callback(user_id)
+    else:
+        start = clock()
+        groups = await acl_callback(user_id)
+        observer.observe('acl.groups',
+                         'forbidden' if groups is None else 'ok',
+                         clock() - start)
+
+    if groups is not None:
+        user_groups = () if user_id is None else \
+            (Group.AuthenticatedUser, user_id)
+        groups = frozenset(
+            itertools.chain(groups, (Group.Everyone,), user_groups))
+
+    state.groups = groups
+    return groups
+
+
+async def get_user_group_mask(request, registry=None):
+    """Returns the groups that the user in this request has access to, as an
+    integer group mask.
+
+    The mask is computed from the groups returned by get_user_groups(), and
+    cached in the request until the groups or the registry change.
+
+    Args:
+        request: aiohttp Request object
+        registry: BitRegistry used to compute the mask, defaults to
+            default_registry.
+
+    Returns:
+        None if get_user_groups() returns None, otherwise the integer mask of
+        the groups.
+
+    Raises:
+        RuntimeError: If the ACL middleware is not installed
+    """
+    if registry is None:
+        registry = default_registry
+
+    groups = await get_user_groups(request)
     if groups is None:
         return None
 
-    user_groups = (Group.AuthenticatedUser, user_id) if user_id is not None else ()
+    # The cached mask is stale if the groups were resolved again since
+    cached = request.get(GROUP_MASK_KEY)
+    if (cached is not None and
+        cached[0] is groups and
+        cached[1] is registry and
+        cached[2] == registry.generation):
+        return cached[3]
 
-    return set(itertools.chain(groups, (Group.Everyone,), user_groups))
+    mask = registry.group_mask(groups)
+    request[GROUP_MASK_KEY] = (groups, registry, registry.generation, mask)
+    return mask
+
+
+def invalidate_user_groups(request):
+    """Discards the groups cached for this request.
+
+    Should be called by handlers that change the group membership of the
+    current user, so the next call to get_user_groups() calls the ACL callback
+    again.
+
+    Args:
+        request: aiohttp Request object
+    """
+    state = request.get(STATE_KEY)
+    if state is not None:
+        state.groups = UNRESOLVED
 
 
 async def get_permitted(request, permission, context):
@@ -88,10 +249,17 @@ async def get_permitted(request, permission, context):
     Groups and permissions need only be immutable objects, so can be strings,
     numbers, enumerations, or other immutable objects.
 
+    For large contexts, the context can be compiled once into a CompiledACL
+    or BitmaskACL object, which avoids scanning every ACL tuple on each call.
+    A Resource can also be passed, in which case the ACL tuples of the
+    resource and its ancestors are checked, from the resource up to the root.
+    Contexts that depend on the request can be loaded by a ContextFactory.
+
     Args:
         request: aiohttp Request object
         permission: The specific permission requested.
-        context: A sequence of ACL tuples
+        context: A sequence of ACL tuples, a CompiledACL or BitmaskACL
+            object, a Resource, or a ContextFactory
 
     Returns:
         The function gets the groups by calling get_user_groups() and returns
@@ -102,13 +270,108 @@ async def get_permitted(request, permission, context):
         RuntimeError: If the ACL middleware is not installed
     """
 
+    state = request.get(STATE_KEY)
+    observer = None if state is None or state.acl is None else \
+        state.acl.observer
+    if observer is None:
+        return await _get_permitted(request, permission, context)
+
+    start = clock()
+    permitted = await _get_permitted(request, permission, context)
+    observer.observe('acl.permitted', 'allowed' if permitted else 'denied',
+                     clock() - start)
+    return permitted
+
+
+async def _get_permitted(request, permission, context):
+    if isinstance(context, ContextFactory):
+        context = await context(request)
+
+    if isinstance(context, BitmaskACL):
+        mask = await get_user_group_mask(request, context.registry)
+        return mask is not None and context.permits(mask, permission)
+
     groups = await get_user_groups(request)
     if groups is None:
         return False
 
+    if isinstance(context, Resource):
+        context = context.compiled_acl()
+
+    if isinstance(context, CompiledACL):
+        return context.permits(groups, permission)
+
+    return _permitted(groups, permission, context)
+
+
+async def get_permitted_many(request, permissions, context):
+    """Returns the set of permissions the groups in the request are allowed.
+
+    This is equivalent to calling get_permitted() for each permission, but
+    gets the groups for the request once, and walks the context in a single
+    pass. This is useful for views that need to check many permissions at
+    once (for example, to decide which actions to display for a resource).
+
+    Args:
+        request: aiohttp Request object
+        permissions: A sequence of permissions to check.
+        context: A sequence of ACL tuples, a CompiledACL or BitmaskACL
+            object, a Resource, or a ContextFactory
+
+    Returns:
+        A set containing the permissions passed that are Allowed, using the
+        same first match semantics as get_permitted().
+
+    Raises:
+        RuntimeError: If the ACL middleware is not installed
+    """
+    if isinstance(context, ContextFactory):
+        context = await context(request)
+
+    if isinstance(context, BitmaskACL):
+        mask = await get_user_group_mask(request, context.registry)
+        if mask is None:
+            return set()
+
+        return {p for p in permissions if context.permits(mask, p)}
+
+    groups = await get_user_groups(request)
+    if groups is None:
+        return set()
+
+    if isinstance(context, Resource):
+        context = context.compiled_acl()
+
+    if isinstance(context, CompiledACL):
+        return {p for p in permissions if context.permits(groups, p)}
+
+    return _permitted_many(groups, permissions, context)
+
+
+def _permitted(groups, permission, context):
+    """Linear scan of a plain context, used when it has not been compiled"""
     for action, group, permissions in context:
         if group in groups:
             if permission in permissions:
                 return action == Permission.Allow
 
     return False
+
+
+def _permitted_many(groups, permissions, context):
+    """Single pass over a plain context, resolving each permission on the
+    first matching tuple"""
+    pending = set(permissions)
+    granted = set()
+    for action, group, acl_permissions in context:
+        if not pending:
+            break
+
+        if group in groups:
+            matched = [p for p in pending if p in acl_permissions]
+            if matched:
+                pending.difference_update(matched)
+                if action == Permission.Allow:
+                    granted.update(matched)
+
+    return granted
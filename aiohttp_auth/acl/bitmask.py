@@ -0,0 +1,169 @@
+from ..permissions import Permission, Group
+from .compiled import _validate_entry
+
+
+class BitRegistry(object):
+    """Interning registry mapping groups and permissions to bit positions.
+
+    Groups and permissions are assigned bit positions the first time they are
+    interned, and keep them for the lifetime of the registry. The Group
+    enumeration members are always interned first. A set of groups can then be
+    represented as a single integer, with one bit set for each interned group.
+    """
+
+    def __init__(self):
+        self._groups = {}
+        self._permissions = {}
+        for group in Group:
+            self.group_bit(group)
+
+    @property
+    def generation(self):
+        """Returns a number that changes whenever a group is interned"""
+        return len(self._groups)
+
+    def group_bit(self, group):
+        """Returns the bit for group, interning the group if required"""
+        position = self._groups.get(group)
+        if position is None:
+            position = self._groups[group] = len(self._groups)
+
+        return 1 << position
+
+    def permission_bit(self, permission):
+        """Returns the bit for permission, interning the permission if
+        required"""
+        position = self._permissions.get(permission)
+        if position is None:
+            position = self._permissions[permission] = len(self._permissions)
+
+        return 1 << position
+
+    def group_mask(self, groups):
+        """Returns the integer mask for a set of groups.
+
+        Groups which have not been interned cannot appear in any context
+        compiled against this registry, so they are ignored rather than
+        interned (user_ids in particular would otherwise grow the registry
+        without bound).
+        """
+        mask = 0
+        positions = self._groups
+        for group in groups:
+            position = positions.get(group)
+            if position is not None:
+                mask |= 1 << position
+
+        return mask
+
+    def permission_mask(self, permissions):
+        """Returns the integer mask for a sequence of permissions, interning
+        them if required"""
+        mask = 0
+        for permission in permissions:
+            mask |= self.permission_bit(permission)
+
+        return mask
+
+
+"""Registry used by BitmaskACL objects when no registry is passed"""
+default_registry = BitRegistry()
+
+
+class BitmaskACL(object):
+    """Immutable ACL context compiled to integer group masks.
+
+    For each permission, the ACL tuples of the context are reduced to a short
+    sequence of (group mask, allowed) runs, where consecutive tuples with the
+    same action are merged and groups already decided by an earlier tuple are
+    removed. Checking a permission is then a bitwise AND of the user's group
+    mask against each run, preserving the first match semantics of a plain
+    context.
+
+    Like CompiledACL, a BitmaskACL is iterable and returns the original ACL
+    tuples in order.
+    """
+
+    __slots__ = ('_entries', '_runs', '_registry')
+
+    def __init__(self, context, registry=None):
+        """Compiles the passed context.
+
+        Args:
+            context: A sequence of ACL tuples.
+            registry: BitRegistry used to intern the groups and permissions,
+                defaults to default_registry.
+
+        Raises:
+            TypeError: If an ACL tuple is malformed.
+        """
+        if registry is None:
+            registry = default_registry
+
+        entries = tuple(_validate_entry(entry) for entry in context)
+
+        # Per permission: list of [mask, allowed] runs, and the mask of
+        # groups already decided for that permission
+        runs = {}
+        decided = {}
+        for action, group, permissions in entries:
+            bit = registry.group_bit(group)
+            allowed = action == Permission.Allow
+            for permission in permissions:
+                registry.permission_bit(permission)
+                seen = decided.get(permission, 0)
+                if seen & bit:
+                    continue
+
+                decided[permission] = seen | bit
+                permission_runs = runs.setdefault(permission, [])
+                if permission_runs and permission_runs[-1][1] == allowed:
+                    permission_runs[-1][0] |= bit
+                else:
+                    permission_runs.append([bit, allowed])
+
+        object.__setattr__(self, '_entries', entries)
+        object.__setattr__(self, '_runs', {
+            p: tuple((m, a) for m, a in r) for p, r in runs.items()})
+        object.__setattr__(self, '_registry', registry)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('BitmaskACL objects are immutable')
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return '<BitmaskACL entries={}>'.format(len(self._entries))
+
+    @property
+    def registry(self):
+        """Returns the BitRegistry the context was compiled against"""
+        return self._registry
+
+    def permits(self, mask, permission):
+        """Returns true if the group mask passed is allowed the permission.
+
+        Args:
+            mask: Integer group mask, as returned by get_user_group_mask().
+            permission: The specific permission requested.
+        """
+        for run_mask, allowed in self._runs.get(permission, ()):
+            if mask & run_mask:
+                return allowed
+
+        return False
+
+    def permitted_mask(self, mask):
+        """Returns the integer permission mask of every permission the group
+        mask passed is allowed"""
+        granted = 0
+        registry = self._registry
+        for permission in self._runs:
+            if self.permits(mask, permission):
+                granted |= registry.permission_bit(permission)
+
+        return granted
@@ -0,0 +1,112 @@
+from ..permissions import Permission
+
+
+class CompiledACL(object):
+    """Immutable, pre-indexed form of a ACL context.
+
+    A compiled ACL is built once from the same sequence of (action, group,
+    permissions) tuples accepted by get_permitted(), and indexes the entries by
+    permission and group. A lookup then only needs to inspect the groups the
+    user is a member of, rather than scanning every tuple of the context.
+
+    The first-match semantics of a plain context are preserved: for each
+    permission, only the first tuple that mentions a particular group is
+    recorded, and the matching group with the lowest position in the original
+    context decides the result.
+
+    A compiled ACL is also iterable, returning the original ACL tuples in
+    order, so it can be used wherever a plain context sequence is expected.
+    """
+
+    __slots__ = ('_entries', '_index')
+
+    def __init__(self, context):
+        """Compiles the passed context.
+
+        Args:
+            context: A sequence of ACL tuples, or another CompiledACL object.
+
+        Raises:
+            TypeError: If an ACL tuple is malformed.
+        """
+        entries = []
+        index = {}
+        for position, entry in enumerate(context):
+            action, group, permissions = _validate_entry(entry)
+            entries.append((action, group, permissions))
+
+            allowed = action == Permission.Allow
+            for permission in permissions:
+                groups = index.setdefault(permission, {})
+                if group not in groups:
+                    groups[group] = (position, allowed)
+
+        object.__setattr__(self, '_entries', tuple(entries))
+        object.__setattr__(self, '_index', index)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CompiledACL objects are immutable')
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return '<CompiledACL entries={}>'.format(len(self._entries))
+
+    def permits(self, groups, permission):
+        """Returns true if the groups passed are allowed the permission.
+
+        Args:
+            groups: A set of groups, as returned by get_user_groups().
+            permission: The specific permission requested.
+
+        Returns:
+            True if the first ACL tuple matching one of the groups and the
+            permission is an Allow tuple, false otherwise.
+        """
+        acl_groups = self._index.get(permission)
+        if not acl_groups:
+            return False
+
+        # Iterate over the smaller of the two collections
+        if len(groups) < len(acl_groups):
+            candidates, lookup = groups, acl_groups
+        else:
+            candidates, lookup = acl_groups, groups
+
+        match = None
+        for group in candidates:
+            if group in lookup:
+                entry = acl_groups[group]
+                if match is None or entry < match:
+                    match = entry
+
+        return match is not None and match[1]
+
+
+def _validate_entry(entry):
+    try:
+        action, group, permissions = entry
+    except (TypeError, ValueError):
+        raise TypeError('ACL entry {!r} is not a (action, group, permissions) '
+                        'tuple'.format(entry))
+
+    if not isinstance(action, Permission):
+        raise TypeError('ACL entry {!r} does not have a Permission '
+                        'action'.format(entry))
+
+    # A bare string is almost always a missing comma in a single element tuple
+    if isinstance(permissions, (str, bytes)):
+        raise TypeError('ACL entry {!r} permissions must be a sequence of '
+                        'permissions, not a string'.format(entry))
+
+    try:
+        permissions = tuple(permissions)
+    except TypeError:
+        raise TypeError('ACL entry {!r} permissions must be a '
+                        'sequence'.format(entry))
+
+    return action, group, permissions
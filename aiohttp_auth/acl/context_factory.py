@@ -0,0 +1,121 @@
+from ..cache import LRUCache, MISSING
+from .bitmask import BitmaskACL
+from .compiled import CompiledACL
+from .resource import Resource
+from .single_flight import SingleFlight
+
+
+"""Key used to store the contexts loaded by context factories in the request
+object"""
+CONTEXTS_KEY = 'aiohttp_auth.acl.contexts'
+
+
+class ContextFactory(object):
+    """Request aware, asynchronous ACL context factory.
+
+    A context factory wraps a coroutine function which takes the request and
+    returns the context of the resource it addresses (for example by loading
+    the ACL of a document from a database). Context factories can be passed
+    to acl_required(), get_permitted() and get_permitted_many() in place of a
+    context.
+
+    Contexts are memoized per request, so several decorators or permission
+    checks on the same request share a single load. If a cache key is
+    declared, contexts are also cached across requests in a bounded LRU cache
+    with a time to live, and concurrent loads of the same key are coalesced.
+    A context loaded while its key is invalidated is not cached.
+    Sequences of ACL tuples returned by the function are compiled into a
+    CompiledACL object before they are cached.
+    """
+
+    def __init__(self, func, key=None, maxsize=1024, ttl=60):
+        """Initializes the context factory.
+
+        Args:
+            func: Coroutine function taking a aiohttp Request object, and
+                returning a sequence of ACL tuples, a CompiledACL, BitmaskACL
+                or Resource object.
+            key: Optional cache key of the context, either the name of a
+                match_info field (such as 'document_id'), or a function taking
+                the request and returning a hashable key. If None, or if the
+                key of a request is None, contexts are only memoized per
+                request.
+            maxsize: Maximum number of contexts cached across requests.
+            ttl: Number of seconds a context remains cached for, or None if
+                contexts do not expire.
+        """
+        self._func = func
+        if isinstance(key, str):
+            field = key
+            key = lambda request: request.match_info.get(field)
+
+        self._key = key
+        self._cache = None if key is None else LRUCache(maxsize, ttl)
+        self._flight = SingleFlight()
+
+    @property
+    def cache(self):
+        """Returns the LRUCache of contexts, or None if no key was declared"""
+        return self._cache
+
+    async def __call__(self, request):
+        """Returns the context for the request"""
+        key = None if self._key is None else self._key(request)
+
+        contexts = request.get(CONTEXTS_KEY)
+        if contexts is None:
+            contexts = request[CONTEXTS_KEY] = {}
+
+        context = contexts.get((self, key), MISSING)
+        if context is not MISSING:
+            return context
+
+        if key is None:
+            context = await self._load(request)
+        else:
+            context = self._cache.get(key)
+            if context is MISSING:
+                generation = self._cache.begin_load(key)
+                try:
+                    context = await self._flight.call(key, self._load, request)
+                finally:
+                    current = self._cache.end_load(key, generation)
+
+                # A context loaded while the key was invalidated may be stale
+                if current:
+                    self._cache.set(key, context)
+
+        contexts[(self, key)] = context
+        return context
+
+    def invalidate(self, key):
+        """Discards the context cached across requests for key"""
+        if self._cache is not None:
+            self._cache.pop(key)
+
+    async def _load(self, request):
+        context = await self._func(request)
+        if not isinstance(context, (CompiledACL, BitmaskACL, Resource)):
+            context = CompiledACL(context)
+
+        return context
+
+
+def context_factory(key=None, maxsize=1024, ttl=60):
+    """Returns a decorator turning a coroutine function into a
+    ContextFactory, for example::
+
+        @context_factory(key='document_id')
+        async def document_context(request):
+            document = await load_document(request.match_info['document_id'])
+            return document.acl
+
+    Args:
+        key: Optional cache key, see ContextFactory.
+        maxsize: Maximum number of contexts cached across requests.
+        ttl: Number of seconds a context remains cached for.
+    """
+    def decorator(func):
+        return ContextFactory(func, key, maxsize, ttl)
+
+    return decorator
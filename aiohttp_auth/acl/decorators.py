@@ -1,6 +1,42 @@
 from functools import wraps
 from aiohttp import web
 from .acl import get_permitted
+from .context_factory import ContextFactory
+
+
+class ACLRequirement(object):
+    """Permission and context required by a view decorated with
+    acl_required().
+
+    The requirements of a view are attached to it as a tuple of
+    ACLRequirement objects (outermost decorator first), so they can be
+    discovered by compile_route_acls().
+    """
+
+    __slots__ = ('permission', 'context', 'compiled')
+
+    def __init__(self, permission, context):
+        self.permission = permission
+        self.context = context
+
+        # Compiled form of a static context, set by compile_route_acls()
+        self.compiled = None
+
+    def __repr__(self):
+        return '<ACLRequirement permission={!r}>'.format(self.permission)
+
+    def resolve(self):
+        """Returns the context to check the permission against. Context
+        factories are returned as is, since they are called with the
+        request by get_permitted()"""
+        if self.compiled is not None:
+            return self.compiled
+
+        if callable(self.context) and \
+                not isinstance(self.context, ContextFactory):
+            return self.context()
+
+        return self.context
 
 
 def acl_required(permission, context):
@@ -15,9 +51,10 @@ def acl_required(permission, context):
 
     Args:
         permission: The specific permission requested.
-        context: Either a sequence of ACL tuples, or a callable that returns a
-            sequence of ACL tuples. For more information on ACL tuples, see
-            get_permission()
+        context: Either a sequence of ACL tuples, a CompiledACL, BitmaskACL
+            or Resource object, a callable without arguments that returns one
+            of these, or a ContextFactory (which is passed the request). For
+            more information on ACL tuples, see get_permission()
 
     Returns:
         A decorator which will check the request passed has the permission for
@@ -26,19 +63,19 @@ def acl_required(permission, context):
     """
 
     def decorator(func):
+        requirement = ACLRequirement(permission, context)
 
         @wraps(func)
         async def wrapper(*args):
             request = args[-1]
 
-            if callable(context):
-                context = context()
-
-            if await get_permitted(request, permission, context):
+            if await get_permitted(request, permission, requirement.resolve()):
                 return await func(*args)
 
             raise web.HTTPForbidden()
 
+        wrapper._acl_requirements = \
+            (requirement,) + getattr(func, '_acl_requirements', ())
         return wrapper
 
     return decorator
@@ -0,0 +1,87 @@
+import time
+from ..cache import LRUCache, MISSING
+
+
+class GroupsCache(LRUCache):
+    """Cross request cache for the groups returned by the acl_middleware
+    callback, keyed by user_id.
+
+    Results of None (which forbid the user) are cached as well, optionally
+    with a different time to live, so repeated requests from a forbidden user
+    do not reach the group backend either.
+
+    Groups loaded while their user_id is invalidated are returned to the
+    request which loaded them, but are not cached.
+
+    A SharedCache can be passed to share the cached groups between every
+    process on a host. It is checked when the per process cache misses, and
+    invalidating a user_id discards the groups for every process.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, negative_ttl=None, shared=None,
+                 **kwargs):
+        """Initializes the groups cache.
+
+        Args:
+            maxsize: Maximum number of user_ids held by the cache.
+            ttl: Number of seconds the groups of a user remain cached for, or
+                None if entries do not expire.
+            negative_ttl: Number of seconds a None result from the callback
+                remains cached for. Defaults to ttl. If 0, None results are
+                not cached.
+            shared: Optional SharedCache object used as a cross process tier.
+                Only entries with a ttl are shared.
+        """
+        super().__init__(maxsize, ttl, **kwargs)
+        self._negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._shared = shared
+
+    def wrap(self, callback):
+        """Returns a coroutine function with the same signature as callback,
+        which returns cached results when they are available.
+
+        Args:
+            callback: The acl_middleware groups callback.
+        """
+        async def _cached_callback(user_id):
+            groups = self.get(user_id)
+            if groups is not MISSING:
+                return groups
+
+            if self._shared is not None:
+                entry = self._shared.get_entry(user_id)
+                if entry is not None:
+                    groups, expires = entry
+                    self.set(user_id, groups, expires - time.time())
+                    return groups
+
+            generation = self.begin_load(user_id)
+            try:
+                groups = await callback(user_id)
+            finally:
+                current = self.end_load(user_id, generation)
+
+            # Groups loaded while the user_id was invalidated may be stale,
+            # so they are only cached if the load is still current
+            if groups is None:
+                if current and self._negative_ttl != 0:
+                    self._store(user_id, None, self._negative_ttl)
+            else:
+                groups = tuple(groups)
+                if current:
+                    self._store(user_id, groups, self._ttl)
+
+            return groups
+
+        return _cached_callback
+
+    def invalidate(self, user_id):
+        """Discards the cached groups for user_id"""
+        self.pop(user_id)
+        if self._shared is not None:
+            self._shared.pop(user_id)
+
+    def _store(self, user_id, groups, ttl):
+        self.set(user_id, groups, ttl)
+        if self._shared is not None and ttl is not None:
+            self._shared.set(user_id, groups, ttl)
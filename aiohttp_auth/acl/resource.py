@@ -0,0 +1,128 @@
+import itertools
+import weakref
+from .compiled import CompiledACL, _validate_entry
+
+
+class Resource(object):
+    """Node of a resource tree (for example org, project and document), with
+    a local ACL and an optional parent resource.
+
+    Permission checks against a resource walk up its lineage: the local ACL
+    of the resource is checked first, then the ACL of its parent, and so on
+    up to the root, with the first matching ACL tuple deciding the result.
+    Resources can be passed to get_permitted(), get_permitted_many() and
+    acl_required() in place of a context.
+
+    The flattened ACL of the lineage is compiled into a CompiledACL once per
+    resource, and cached until the local ACL or the parent of the resource
+    or one of its ancestors changes. Changes are pushed down to the
+    descendants of a resource (which are tracked with weak references), so a
+    permission check never walks the tree, and the compiled ACL of a resource
+    is built from the cached compiled ACL of its parent.
+
+    Applications typically subclass Resource to attach their own data, or
+    create resources from their database models.
+    """
+
+    __slots__ = ('_acl', '_parent', '_children', '_compiled', '_version',
+                 '__weakref__')
+
+    def __init__(self, acl=(), parent=None):
+        """Initializes the resource.
+
+        Args:
+            acl: Sequence of ACL tuples local to this resource.
+            parent: Optional parent Resource.
+
+        Raises:
+            TypeError: If an ACL tuple is malformed.
+        """
+        self._acl = _validate(acl)
+        self._parent = None
+        self._children = weakref.WeakSet()
+        self._compiled = None
+        self._version = 0
+        if parent is not None:
+            self.parent = parent
+
+    @property
+    def acl(self):
+        """Returns the tuple of ACL tuples local to this resource"""
+        return self._acl
+
+    @acl.setter
+    def acl(self, acl):
+        """Replaces the local ACL, invalidating the compiled ACL of this
+        resource and its descendants"""
+        self._acl = _validate(acl)
+        self.invalidate()
+
+    @property
+    def parent(self):
+        """Returns the parent resource, or None for a root resource"""
+        return self._parent
+
+    @parent.setter
+    def parent(self, parent):
+        """Moves the resource under another parent (or makes it a root if
+        None), invalidating the compiled ACL of this resource and its
+        descendants"""
+        if parent is not None and any(r is self for r in parent.lineage()):
+            raise ValueError('A resource cannot be its own ancestor')
+
+        if self._parent is not None:
+            self._parent._children.discard(self)
+        if parent is not None:
+            parent._children.add(self)
+
+        self._parent = parent
+        self.invalidate()
+
+    @property
+    def version(self):
+        """Returns a number incremented each time the compiled ACL of this
+        resource is invalidated, which can be used to key external caches"""
+        return self._version
+
+    def lineage(self):
+        """Returns an iterator over this resource and its ancestors, up to the
+        root resource"""
+        resource = self
+        while resource is not None:
+            yield resource
+            resource = resource._parent
+
+    def compiled_acl(self):
+        """Returns the CompiledACL of the lineage of this resource, which
+        holds the local ACL tuples of this resource followed by those of its
+        ancestors"""
+        compiled = self._compiled
+        if compiled is None:
+            inherited = () if self._parent is None else \
+                self._parent.compiled_acl()
+            compiled = CompiledACL(itertools.chain(self._acl, inherited))
+            self._compiled = compiled
+
+        return compiled
+
+    def invalidate(self):
+        """Discards the compiled ACL of this resource and its descendants.
+
+        Called automatically when the acl or parent of a resource is
+        changed. Subclasses that compute their local ACL dynamically should
+        call it when the ACL changes.
+        """
+        pending = [self]
+        while pending:
+            resource = pending.pop()
+            resource._compiled = None
+            resource._version += 1
+            pending.extend(resource._children)
+
+    def __repr__(self):
+        return '<{} acl={} version={}>'.format(
+            type(self).__name__, len(self._acl), self._version)
+
+
+def _validate(acl):
+    return tuple(_validate_entry(entry) for entry in acl)
@@ -0,0 +1,114 @@
+from collections import namedtuple
+from .bitmask import BitmaskACL
+from .compiled import CompiledACL
+from .resource import Resource
+
+
+"""Key used to store the route permissions table in the application object"""
+ROUTE_PERMISSIONS_KEY = 'aiohttp_auth.acl.route_permissions'
+
+"""Permissions required by a route, as published by compile_route_acls().
+The permissions are a tuple of (permission, context) tuples, where static
+contexts have been compiled, and callable contexts are passed as is."""
+RoutePermissions = namedtuple(
+    'RoutePermissions', 'method path name auth_required permissions')
+
+
+def setup_route_acls(app):
+    """Arranges for compile_route_acls() to be called when the application
+    starts.
+
+    If the application has no on_startup signal (older aiohttp versions),
+    compile_route_acls() is called immediately, so this function must then be
+    called after every route has been added.
+
+    Args:
+        app: aiohttp Application object
+    """
+    on_startup = getattr(app, 'on_startup', None)
+    if on_startup is None:
+        compile_route_acls(app)
+        return
+
+    # The table is filled in place at startup, since the application state
+    # should not be changed once the application has started
+    app[ROUTE_PERMISSIONS_KEY] = []
+
+    async def _compile_route_acls(app):
+        compile_route_acls(app)
+
+    on_startup.append(_compile_route_acls)
+
+
+def compile_route_acls(app):
+    """Compiles and validates the ACL contexts of every route handler
+    decorated with acl_required(), and publishes the permissions required by
+    each route in app[ROUTE_PERMISSIONS_KEY].
+
+    Static contexts given as a sequence of ACL tuples are compiled into a
+    CompiledACL object once, which the decorators then use for every
+    request. Callable contexts are left to be called per request.
+
+    Args:
+        app: aiohttp Application object
+
+    Returns:
+        The list of RoutePermissions objects, one per route.
+
+    Raises:
+        TypeError: If the context of a route contains a malformed ACL tuple.
+    """
+    table = app.get(ROUTE_PERMISSIONS_KEY)
+    if table is None:
+        table = app[ROUTE_PERMISSIONS_KEY] = []
+
+    entries = []
+    for route in app.router.routes():
+        path = _route_path(route)
+        handler = route.handler
+        permissions = []
+        for requirement in getattr(handler, '_acl_requirements', ()):
+            try:
+                context = _compile(requirement)
+            except TypeError as e:
+                raise TypeError('Invalid ACL for route {} {}: {}'.format(
+                    route.method, path, e)) from e
+
+            permissions.append((requirement.permission, context))
+
+        entries.append(RoutePermissions(
+            route.method, path, route.name,
+            getattr(handler, '_auth_required', False), tuple(permissions)))
+
+    table[:] = entries
+    return table
+
+
+def _route_path(route):
+    """Returns the path (or path formatter or prefix) of a route"""
+    # Routes (or their resources) describe themselves with get_info() on
+    # aiohttp 0.21 and later, older routes only hold the path privately
+    for target in (route, getattr(route, 'resource', None)):
+        get_info = getattr(target, 'get_info', None)
+        if get_info is not None:
+            info = get_info()
+            return info.get('path', info.get('formatter', info.get('prefix')))
+
+    for name in ('_path', '_formatter', '_prefix'):
+        path = getattr(route, name, None)
+        if path is not None:
+            return path
+
+    return None
+
+
+def _compile(requirement):
+    context = requirement.context
+    if callable(context) or isinstance(
+            context, (CompiledACL, BitmaskACL, Resource)):
+        return context
+
+    if requirement.compiled is None:
+        requirement.compiled = CompiledACL(context)
+
+    return requirement.compiled
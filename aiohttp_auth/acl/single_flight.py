@@ -0,0 +1,85 @@
+import asyncio
+
+
+class _Call(object):
+    """In flight call shared by the coroutines waiting on its result"""
+
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls for the same key into a single call.
+
+    While a call for a key is in flight, any other call for the same key
+    waits for, and shares, the result of the first call (including any
+    exception raised). Once the call completes, the next call for the key
+    starts a new one, so results are never stale.
+
+    Cancelling a waiting coroutine does not cancel the shared call while other
+    coroutines are still waiting for it. If every waiter is cancelled, the
+    shared call is cancelled too, so no call outlives its callers.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    def __len__(self):
+        """Returns the number of calls in flight"""
+        return len(self._calls)
+
+    async def call(self, key, func, *args):
+        """Awaits func(*args), sharing the call with any concurrent call for
+        the same key.
+
+        Args:
+            key: Hashable key identifying the call.
+            func: Coroutine function to call.
+            args: Arguments passed to func.
+
+        Returns:
+            The result of func(*args).
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(func(*args)))
+            call.task.add_done_callback(
+                lambda task: self._call_done(key, call))
+            self._calls[key] = call
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Forget the call before cancelling it, so a call for the key
+                # made before the task finishes starts a new call, rather
+                # than joining this one and being cancelled with it
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                call.task.cancel()
+
+    def wrap(self, func):
+        """Returns a coroutine function taking a single key argument, which
+        coalesces concurrent calls to func(key).
+
+        Args:
+            func: Coroutine function taking a single argument, such as the
+                acl_middleware groups callback.
+        """
+        async def _single_flight_call(key):
+            return await self.call(key, func, key)
+
+        return _single_flight_call
+
+    def _call_done(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+        # Mark any exception as retrieved, waiters receive it through shield
+        if not call.task.cancelled():
+            call.task.exception()
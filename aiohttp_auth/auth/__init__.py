@@ -1,6 +1,20 @@
-from .auth import auth_middleware, get_auth, remember, forget
+from .auth import (
+    auth_middleware,
+    get_auth,
+    remember,
+    forget,
+    check_rate_limit,
+    record_failure)
 from .decorators import auth_required
+from .exempt import ExemptRoutes
 from .cookie_ticket_auth import CookieTktAuthentication
+from .store_ticket_auth import StoreTktAuthentication
+from .revocation import RevocationFilter
+from .rate_limit import RateLimiter, TokenBuckets
+from .ticket_store import (
+    AbstractTicketStore,
+    MemoryTicketStore,
+    SQLiteTicketStore)
 
 try:
     # SessionTktAuthentication may fail import if aiohttp_session not installed
@@ -36,6 +36,19 @@ class AbstractAuthentication(object):
         """
         pass
 
+    async def has_credentials(self, request):
+        """Called to check whether the request carries credentials for the
+        policy to authenticate (such as a ticket cookie), without validating
+        them. auth_middleware only applies its rate limiter to requests with
+        credentials.
+
+        Default implementation returns True.
+
+        Args:
+            request: aiohttp Request object.
+        """
+        return True
+
     async def process_response(self, request, response):
         """Called to perform any processing of the response required (setting
         cookie data, etc).
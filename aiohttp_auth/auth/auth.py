@@ -1,44 +1,122 @@
+import math
+from aiohttp import web
 from .abstract_auth import AbstractAuthentication
+from .exempt import ExemptRoutes
+from ..instrumentation import clock
+from ..state import STATE_KEY, UNRESOLVED, AuthSettings, get_state
 
-"""Key used to store the auth policy in the request object"""
-POLICY_KEY = 'aiohttp_auth.policy'
 
-"""Key used to cache the auth credentials in the request object"""
-AUTH_KEY = 'aiohttp_auth.auth'
-
-
-def auth_middleware(policy):
+def auth_middleware(policy, exempt_routes=(), exempt_prefixes=(),
+                    observer=None, rate_limiter=None, new_style=False,
+                    login_routes=()):
     """Returns a aiohttp_auth middleware factory for use by the aiohttp
     application object.
 
+    Requests for exempt routes bypass the policy entirely. The policy is not
+    consulted for the request, or given the response to process, and
+    get_auth() always returns None for these requests. This is intended for
+    static assets, health checks and other routes that never need the
+    authentication details of the user.
+
     Args:
         policy: A authentication policy with a base class of
             AbstractAuthentication.
+        exempt_routes: Optional sequence of route names to exempt.
+        exempt_prefixes: Optional sequence of path prefixes to exempt (for
+            example '/static/').
+        observer: Optional instrumentation.Observer object, which is passed
+            the duration and outcome of the policy get() and
+            process_response() calls, and of ticket validation.
+        rate_limiter: Optional RateLimiter object. Requests carrying a ticket
+            from a client ip that exhausted its budget of failed tickets are
+            rejected with HTTPTooManyRequests before the ticket is validated,
+            except for exempt and login routes.
+        new_style: If true, returns a new style middleware (a coroutine
+            function taking the request and handler, as created by the
+            web.middleware decorator of aiohttp 2.3 and later) rather than a
+            middleware factory. New style middlewares avoid creating a
+            handler for every request.
+        login_routes: Optional sequence of route names of the login views,
+            which are never rejected by the rate limiter, so clients can
+            always log in again. Login views should call check_rate_limit()
+            with the user_id instead.
     """
     assert isinstance(policy, AbstractAuthentication)
+    exempt = ExemptRoutes(exempt_routes, exempt_prefixes)
+    middleware = _auth_middleware(policy, exempt, observer, rate_limiter,
+                                  ExemptRoutes(login_routes))
+    if new_style:
+        return middleware
 
-    async def _auth_middleware_factory(app, handler):
+    return _middleware_factory(middleware)
 
-        async def _middleware_handler(request):
-            # Save the policy in the request
-            request[POLICY_KEY] = policy
 
-            # Call the next handler in the chain
-            response = await handler(request)
+def _auth_middleware(policy, exempt, observer, rate_limiter, login,
+                     prepare=None):
+    """Returns the new style middleware doing the per request work of
+    auth_middleware, where exempt and login are ExemptRoutes objects. If
+    passed, prepare(state) is called first with the AuthState of every
+    request, which lets other middlewares share this one."""
+    settings = AuthSettings(policy, observer, rate_limiter)
+
+    async def _middleware(request, handler):
+        state = get_state(request)
+        if prepare is not None:
+            prepare(state)
+
+        if exempt and exempt.match(request):
+            # Resolve as unauthenticated without touching the policy
+            state.identity = None
+            return await handler(request)
 
-            # Give the policy a chance to handle the response
+        if rate_limiter is not None and not (login and login.match(request)):
+            delay = rate_limiter.ticket_retry_after(request)
+            # Clients without credentials are never rejected, since they
+            # may share the address of a client sending failed tickets
+            if delay is not None and await policy.has_credentials(request):
+                raise _too_many_requests(delay)
+
+        # Save the policy and settings in the request
+        state.auth = settings
+
+        # Call the next handler in the chain
+        response = await handler(request)
+
+        # Give the policy a chance to handle the response
+        if observer is None:
             await policy.process_response(request, response)
+        else:
+            start = clock()
+            await policy.process_response(request, response)
+            observer.observe('auth.process_response', 'ok',
+                             clock() - start)
+
+        return response
+
+    # Same marker as set by aiohttp's web.middleware decorator
+    _middleware.__middleware_version__ = 1
+    return _middleware
 
-            return response
+
+def _middleware_factory(middleware):
+    """Returns an old style middleware factory calling a new style
+    middleware"""
+
+    async def _middleware_factory(app, handler):
+        async def _middleware_handler(request):
+            return await middleware(request, handler)
 
         return _middleware_handler
 
-    return _auth_middleware_factory
+    return _middleware_factory
 
 
 async def get_auth(request):
     """Returns the user_id associated with a particular request.
 
+    The user_id is resolved by the policy once per request, and cached in the
+    request (including a None result for unauthenticated requests).
+
     Args:
         request: aiohttp Request object.
 
@@ -50,21 +128,39 @@ async def get_auth(request):
         RuntimeError: Middleware is not installed
     """
 
-    auth_val = request.get(AUTH_KEY)
-    if auth_val:
+    state = request.get(STATE_KEY)
+    if state is None:
+        raise RuntimeError('auth_middleware not installed')
+
+    auth_val = state.identity
+    if auth_val is not UNRESOLVED:
         return auth_val
 
-    auth_policy = request.get(POLICY_KEY)
-    if auth_policy is None:
+    settings = state.auth
+    if settings is None:
         raise RuntimeError('auth_middleware not installed')
 
-    request[AUTH_KEY] = await auth_policy.get(request)
-    return request[AUTH_KEY]
+    auth_policy = settings.policy
+    observer = settings.observer
+    if observer is None:
+        auth_val = await auth_policy.get(request)
+    else:
+        start = clock()
+        auth_val = await auth_policy.get(request)
+        observer.observe('auth.get',
+                         'anonymous' if auth_val is None else 'authenticated',
+                         clock() - start)
+
+    state.identity = auth_val
+    return auth_val
 
 
 async def remember(request, user_id):
     """Called to store and remember the userid for a request
 
+    Subsequent calls to get_auth() for this request return the remembered
+    user_id.
+
     Args:
         request: aiohttp Request object.
         user_id: String representing the user_id to remember
@@ -72,25 +168,89 @@ async def remember(request, user_id):
     Raises:
         RuntimeError: Middleware is not installed
     """
-    auth_policy = request.get(POLICY_KEY)
-    if auth_policy is None:
-        raise RuntimeError('auth_middleware not installed')
-
-    return await auth_policy.remember(request, user_id)
+    state = _installed_state(request)
+    await state.auth.policy.remember(request, user_id)
+    state.identity = user_id
+    state.reissue = None
+    state.groups = UNRESOLVED
 
 
 async def forget(request):
     """Called to forget the userid for a request
 
+    Subsequent calls to get_auth() for this request return None.
+
     Args:
         request: aiohttp Request object
 
     Raises:
         RuntimeError: Middleware is not installed
     """
-    auth_policy = request.get(POLICY_KEY)
-    if auth_policy is None:
+    state = _installed_state(request)
+    await state.auth.policy.forget(request)
+    state.identity = None
+    state.reissue = None
+    state.groups = UNRESOLVED
+
+
+def check_rate_limit(request, user_id=None):
+    """Checks the client ip of the request, and the user_id if passed, are
+    within the budget of failed authentication attempts of the rate limiter.
+
+    Login views should call this function before verifying the password, so
+    that floods of login attempts are rejected without hashing passwords.
+    Does nothing if auth_middleware was not given a rate limiter.
+
+    Args:
+        request: aiohttp Request object.
+        user_id: Optional user_id the request attempts to log in as.
+
+    Raises:
+        HTTPTooManyRequests: The budget is exhausted.
+    """
+    rate_limiter = _rate_limiter(request)
+    if rate_limiter is None:
+        return
+
+    delay = rate_limiter.retry_after(request, user_id)
+    if delay is not None:
+        raise _too_many_requests(delay)
+
+
+def record_failure(request, user_id=None):
+    """Records a failed authentication attempt (such as a wrong password)
+    against the client ip of the request, and the user_id if passed.
+
+    Does nothing if auth_middleware was not given a rate limiter.
+
+    Args:
+        request: aiohttp Request object.
+        user_id: Optional user_id the request attempted to log in as.
+    """
+    rate_limiter = _rate_limiter(request)
+    if rate_limiter is not None:
+        rate_limiter.record_failure(request, user_id)
+
+
+def _installed_state(request):
+    """Returns the AuthState of a request handled by auth_middleware"""
+    state = request.get(STATE_KEY)
+    if state is None or state.auth is None:
         raise RuntimeError('auth_middleware not installed')
 
-    return await auth_policy.forget(request)
+    return state
+
+
+def _rate_limiter(request):
+    """Returns the RateLimiter of the auth_middleware handling a request, or
+    None"""
+    state = request.get(STATE_KEY)
+    if state is None or state.auth is None:
+        return None
+
+    return state.auth.rate_limiter
+
 
+def _too_many_requests(delay):
+    return web.HTTPTooManyRequests(
+        headers={'Retry-After': str(int(math.ceil(delay)))})
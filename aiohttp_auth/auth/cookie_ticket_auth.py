@@ -1,7 +1,10 @@
+from aiohttp import hdrs
 from .ticket_auth import TktAuthentication
+from ..state import STATE_KEY, get_state
 
 
-COOKIE_AUTH_KEY = 'aiohttp_auth.auth.CookieTktAuthentication'
+# Returned by _find_cookie() when the header needs to be fully parsed
+_PARSE = object()
 
 
 class CookieTktAuthentication(TktAuthentication):
@@ -12,15 +15,15 @@ class CookieTktAuthentication(TktAuthentication):
     async def remember_ticket(self, request, ticket):
         """Called to store the ticket data for a request.
 
-        Ticket data is stored in COOKIE_AUTH_KEY in the request object, and
-        written as cookie data to the response during the process_response()
-        function.
+        Ticket data is stored in the cookie attribute of the AuthState of the
+        request, and written as cookie data to the response during the
+        process_response() function.
 
         Args:
             request: aiohttp Request object.
             ticket: String like object representing the ticket to be stored.
         """
-        request[COOKIE_AUTH_KEY] = ticket
+        get_state(request).cookie = ticket
 
     async def forget_ticket(self, request):
         """Called to forget the ticket data a request
@@ -28,7 +31,7 @@ class CookieTktAuthentication(TktAuthentication):
         Args:
             request: aiohttp Request object.
         """
-        request[COOKIE_AUTH_KEY] = ''
+        get_state(request).cookie = ''
 
     async def get_ticket(self, request):
         """Called to return the ticket for a request.
@@ -40,13 +43,23 @@ class CookieTktAuthentication(TktAuthentication):
             A ticket (string like) object, or None if no ticket is available
             for the passed request.
         """
-        return request.cookies.get(self.cookie_name, None)
+        header = request.headers.get(hdrs.COOKIE)
+        if not header:
+            return None
+
+        # Scan the header for our cookie only, rather than parsing every
+        # cookie the client sends, unless the value needs unquoting.
+        value = _find_cookie(header, self.cookie_name)
+        if value is _PARSE:
+            return request.cookies.get(self.cookie_name, None)
+
+        return value
 
     async def process_response(self, request, response):
         """Called to perform any processing of the response required.
 
-        This function stores any cookie data in the COOKIE_AUTH_KEY as a
-        cookie in the response object. If the value is a empty string, the
+        This function stores any cookie data of the AuthState of the request
+        as a cookie in the response object. If the value is a empty string, the
         associated cookie is deleted instead.
 
         This function requires the response to be a aiohttp Response object,
@@ -61,12 +74,47 @@ class CookieTktAuthentication(TktAuthentication):
             RuntimeError: Raised if response has already started.
         """
         await super().process_response(request, response)
-        if COOKIE_AUTH_KEY in request:
-            if response.started:
+        state = request.get(STATE_KEY)
+        if state is not None and state.cookie is not None:
+            if response.prepared:
                 raise RuntimeError("Cannot save cookie into started response")
 
-            cookie = request[COOKIE_AUTH_KEY]
+            cookie = state.cookie
             if cookie == '':
                 response.del_cookie(self.cookie_name)
             else:
                 response.set_cookie(self.cookie_name, cookie)
+
+
+def _find_cookie(header, name):
+    """Returns the value of the cookie name in the Cookie header, None if the
+    cookie is not present, or _PARSE if the value is quoted (or otherwise
+    needs the full cookie parser).
+
+    As with the cookie parser, the last occurrence of the cookie wins. Any
+    other occurrence of the name in the header is left to the cookie parser.
+    """
+    key = name + '='
+    pos = header.rfind(key)
+    while pos != -1:
+        # The name must start a cookie pair, not end another name or value
+        start = pos
+        while start > 0 and header[start - 1] in ' \t':
+            start -= 1
+
+        if start == 0 or header[start - 1] == ';':
+            value_start = pos + len(key)
+            value_end = header.find(';', value_start)
+            if value_end == -1:
+                value_end = len(header)
+
+            value = header[value_start:value_end].strip()
+            if '"' in value or '\\' in value:
+                return _PARSE
+
+            return value
+
+        pos = header.rfind(key, 0, pos)
+
+    # Whitespace around the '=' is tolerated by the cookie parser
+    return _PARSE if name in header else None
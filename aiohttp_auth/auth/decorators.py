@@ -30,5 +30,7 @@ def auth_required(func):
 
         return await func(*args)
 
+    # Marks the view for aiohttp_auth.acl.compile_route_acls()
+    wrapper._auth_required = True
     return wrapper
 
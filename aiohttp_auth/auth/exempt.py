@@ -0,0 +1,60 @@
+class ExemptRoutes(object):
+    """Set of route names and path prefixes that bypass the auth_middleware.
+
+    Route names are held in a set, and path prefixes are compiled into a
+    character trie, so checking a request costs at most one pass over its
+    path regardless of the number of prefixes.
+    """
+
+    # Trie node key marking the end of a prefix. Path characters are always
+    # single character strings, so this can never clash with them.
+    _END = ''
+
+    def __init__(self, names=(), prefixes=()):
+        """Compiles the exempt route names and path prefixes.
+
+        Args:
+            names: Sequence of route names, as passed to the aiohttp router
+                when adding a route.
+            prefixes: Sequence of path prefixes (for example '/static/').
+                Any request path starting with one of these is exempt.
+        """
+        self._names = frozenset(names)
+        self._trie = {}
+        for prefix in prefixes:
+            if not prefix:
+                raise ValueError('Exempt path prefixes cannot be empty')
+
+            node = self._trie
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[self._END] = True
+
+    def __bool__(self):
+        return bool(self._names or self._trie)
+
+    def match_path(self, path):
+        """Returns true if the path starts with one of the exempt prefixes"""
+        node = self._trie
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                return False
+
+            if self._END in node:
+                return True
+
+        return False
+
+    def match(self, request):
+        """Returns true if the request is for an exempt route or path.
+
+        Args:
+            request: aiohttp Request object.
+        """
+        if self._names:
+            route = getattr(request.match_info, 'route', None)
+            if route is not None and route.name in self._names:
+                return True
+
+        return self.match_path(request.path)
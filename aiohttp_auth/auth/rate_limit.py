@@ -0,0 +1,197 @@
+import time
+from array import array
+
+
+# Mask keeping the low 64 bits of an integer
+_MASK64 = (1 << 64) - 1
+
+
+class TokenBuckets(object):
+    """Memory bounded, approximate table of token buckets.
+
+    Rather than holding a bucket per key, keys are hashed into depth rows of
+    width buckets (like a count-min sketch), and every bucket a key hashes to
+    is drained when the key consumes tokens. A bucket shared with other keys
+    can only hold fewer tokens than the key's own bucket would, so the
+    estimate for a key is the fullest of its buckets. Keys never get more
+    than their budget, but may occasionally be limited early when all of
+    their buckets collide with heavily limited keys.
+    """
+
+    def __init__(self, rate, burst, width=4096, depth=4, clock=time.monotonic):
+        """Initializes the buckets.
+
+        Args:
+            rate: Number of tokens added to a bucket per second.
+            burst: Maximum number of tokens held by a bucket (the number of
+                tokens available to a new key).
+            width: Number of buckets per row.
+            depth: Number of rows (buckets per key).
+            clock: Function returning the current time in seconds.
+        """
+        self._rate = rate
+        self._burst = burst
+        self._width = width
+        self._depth = depth
+        self._clock = clock
+        self._tokens = array('d', [burst]) * (width * depth)
+        self._updated = array('d', [clock()]) * (width * depth)
+
+    def tokens(self, key):
+        """Returns the estimated number of tokens available to key"""
+        now = self._clock()
+        return max(self._refill(i, now) for i in self._indexes(key))
+
+    def consume(self, key, tokens=1):
+        """Consumes tokens from the buckets of key.
+
+        Returns:
+            True if enough tokens were available (and were consumed), or False
+            if the budget of the key is exhausted.
+        """
+        now = self._clock()
+        indexes = self._indexes(key)
+        if max(self._refill(i, now) for i in indexes) < tokens:
+            return False
+
+        for i in indexes:
+            self._tokens[i] = max(0.0, self._tokens[i] - tokens)
+
+        return True
+
+    def retry_after(self, key, tokens=1):
+        """Returns the number of seconds until tokens are available to key"""
+        missing = tokens - self.tokens(key)
+        return max(0.0, missing / self._rate)
+
+    def _indexes(self, key):
+        width = self._width
+        key = hash(key)
+        indexes = []
+        for row in range(self._depth):
+            # splitmix64 of the key hash for each row. hash((row, key)) is
+            # not used, since before Python 3.8 its low bits only depend on
+            # the low bits of hash(key), so every row collides at once.
+            z = (key + (row + 1) * 0x9E3779B97F4A7C15) & _MASK64
+            z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+            z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+            indexes.append(row * width + (z ^ (z >> 31)) % width)
+
+        return indexes
+
+    def _refill(self, index, now):
+        tokens = min(self._burst, self._tokens[index] +
+                     (now - self._updated[index]) * self._rate)
+        self._tokens[index] = tokens
+        self._updated[index] = now
+        return tokens
+
+
+class RateLimiter(object):
+    """Limits the number of failed authentication attempts per client ip and
+    per user_id.
+
+    Invalid or forged tickets consume a token from the ticket budget of the
+    client ip. Once it is exhausted, auth_middleware rejects further requests
+    from the client ip with 429 Too Many Requests before any ticket is
+    validated. Requests without a ticket, and requests for exempt and login
+    routes, are never rejected. Failed tickets are deleted from the client,
+    so a stale ticket only counts once.
+
+    Failed logins reported with record_failure() consume a token from the
+    separate login budget of the client ip, and from the budget of the
+    user_id if it is known. Once either is exhausted, check_rate_limit()
+    rejects login attempts before any password is hashed. Keeping the budgets
+    apart means failed tickets never prevent a client from logging in again.
+    """
+
+    def __init__(self, ip_rate=1, ip_burst=20, user_rate=0.1, user_burst=10,
+                 width=4096, depth=4, clock=time.monotonic, client_ip=None):
+        """Initializes the rate limiter.
+
+        Args:
+            ip_rate: Number of failures per second allowed per client ip,
+                once the burst is used (for each of the ticket and login
+                budgets).
+            ip_burst: Number of failures allowed per client ip in a burst.
+            user_rate: Number of failures per second allowed per user_id,
+                once the burst is used.
+            user_burst: Number of failures allowed per user_id in a burst.
+            width: Number of buckets per row of the approximate tables. Each
+                table uses 16 * width * depth bytes.
+            depth: Number of rows of the approximate tables.
+            clock: Function returning the current time in seconds.
+            client_ip: Optional function taking the request and returning the
+                address of the client (or None if unknown). Defaults to the
+                peer address of the connection, which behind a reverse proxy
+                or NAT is shared by many clients, so deployments behind a
+                proxy should pass a function returning the client address the
+                proxy forwarded.
+        """
+        self._client_ip = _client_ip if client_ip is None else client_ip
+        self._tickets = TokenBuckets(ip_rate, ip_burst, width, depth, clock)
+        self._ips = TokenBuckets(ip_rate, ip_burst, width, depth, clock)
+        self._users = TokenBuckets(user_rate, user_burst, width, depth, clock)
+
+    def ticket_retry_after(self, request):
+        """Returns None if the client ip of the request is within its budget
+        of failed tickets, or the number of seconds until it is.
+
+        Args:
+            request: aiohttp Request object.
+        """
+        ip = self._client_ip(request)
+        if ip is None:
+            return None
+
+        return self._tickets.retry_after(ip) or None
+
+    def record_ticket_failure(self, request):
+        """Records an invalid, forged or revoked ticket.
+
+        Args:
+            request: aiohttp Request object.
+        """
+        ip = self._client_ip(request)
+        if ip is not None:
+            self._tickets.consume(ip)
+
+    def retry_after(self, request, user_id=None):
+        """Returns None if the client ip (and user_id, if passed) of the
+        request are within their budget of failed logins, or the number of
+        seconds until they are.
+
+        Args:
+            request: aiohttp Request object.
+            user_id: Optional user_id the request attempts to log in as.
+        """
+        delay = 0.0
+        ip = self._client_ip(request)
+        if ip is not None:
+            delay = self._ips.retry_after(ip)
+        if user_id is not None:
+            delay = max(delay, self._users.retry_after(user_id))
+
+        return delay or None
+
+    def record_failure(self, request, user_id=None):
+        """Records a failed login.
+
+        Args:
+            request: aiohttp Request object.
+            user_id: Optional user_id the request attempted to log in as.
+        """
+        ip = self._client_ip(request)
+        if ip is not None:
+            self._ips.consume(ip)
+        if user_id is not None:
+            self._users.consume(user_id)
+
+
+def _client_ip(request):
+    transport = request.transport
+    if transport is None:
+        return None
+
+    peername = transport.get_extra_info('peername')
+    return peername[0] if peername else None
@@ -0,0 +1,183 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+import time
+from .ticket_store import SQLiteTicketStore
+from ..shared_cache import _FileLock, _open_private
+
+
+class RevocationFilter(object):
+    """Memory bounded, cross process record of revoked tickets.
+
+    Revoked tickets are identified by the MAC and expiration time parsed from
+    them, rather than by the ticket string, so a revoked ticket cannot be
+    replayed in another encoding of the same fields (such as a hex timestamp
+    in upper case). Revoked tickets are added to a Bloom filter held in a
+    memory mapped file, so every worker process on a host shares a single
+    copy and sees new revocations without any IPC. Since a Bloom filter can
+    return false positives, a positive hit is confirmed against an exact
+    store of revoked tickets before the ticket is rejected.
+
+    The filter is divided into time slots by the expiration time of the
+    revoked tickets. A slot is recycled once every ticket it holds has
+    expired, so expired revocations are discarded automatically and the
+    memory used is fixed.
+    """
+
+    _MAGIC = b'AATRF001'
+
+    # magic, slots, bits per slot, hash count, slot span
+    _HEADER = struct.Struct('>8sIIIQ')
+
+    # Epoch (valid_until // slot span) of the tickets held in a slot
+    _SLOT_HEADER = struct.Struct('>Q')
+
+    def __init__(self, path, max_age, capacity=100000, error_rate=0.001,
+                 slots=4, store=None):
+        """Initializes the filter, creating the file if required.
+
+        Every process sharing a file must use the same max_age, capacity,
+        error_rate and slots.
+
+        Args:
+            path: Path of the memory mapped filter file.
+            max_age: Maximum age of the tickets, as passed to the ticket
+                policy.
+            capacity: Expected maximum number of revocations per slot (each
+                slot covers max_age / (slots - 1) seconds of expiration
+                times).
+            error_rate: Target false positive rate of the filter, which is
+                the fraction of lookups that need to be confirmed by the
+                exact store.
+            slots: Number of time slots, at least 2.
+            store: AbstractTicketStore used as the exact store. Defaults to
+                a SQLiteTicketStore in path + '.sqlite', which is shared by
+                every process using the filter.
+
+        Raises:
+            OSError: If the file cannot be created or mapped, or is not a
+                regular file owned by the current user with 0600
+                permissions.
+            ValueError: If the file exists with different parameters.
+        """
+        if slots < 2:
+            raise ValueError('A revocation filter needs at least 2 slots')
+
+        self._slots = slots
+        self._span = max(1, int(math.ceil(max_age / (slots - 1))))
+        self._bits = int(math.ceil(
+            -capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self._bits += -self._bits % 8
+        self._hashes = max(1, int(round(self._bits / capacity * math.log(2))))
+        self._slot_size = self._SLOT_HEADER.size + self._bits // 8
+
+        self._store = store
+        if store is None:
+            self._store = SQLiteTicketStore(path + '.sqlite')
+
+        self._fd = _open_private(path)
+        try:
+            self._map = self._open()
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    def close(self):
+        """Unmaps and closes the filter file"""
+        self._map.close()
+        os.close(self._fd)
+
+    async def revoke(self, mac, valid_until):
+        """Revokes a ticket until its expiration time.
+
+        Args:
+            mac: String or bytes identifying the MAC of the ticket to
+                revoke, as parsed from it by the ticket factory (rather than
+                copied from the ticket string).
+            valid_until: Expiration time of the ticket.
+        """
+        ttl = valid_until - time.time()
+        if ttl <= 0:
+            return
+
+        digest = self._digest(mac, valid_until)
+        await self._store.set(digest.hex(), '1', ttl)
+
+        epoch = int(valid_until) // self._span
+        offset = self._slot_offset(epoch)
+        with _FileLock(self._fd):
+            current, = self._SLOT_HEADER.unpack_from(self._map, offset)
+            if current > epoch:
+                # The slot holds later tickets, so this ticket has expired
+                return
+
+            if current < epoch:
+                # Recycle the slot, every ticket it held has expired
+                start = offset + self._SLOT_HEADER.size
+                self._map[start:offset + self._slot_size] = \
+                    bytes(self._slot_size - self._SLOT_HEADER.size)
+                self._SLOT_HEADER.pack_into(self._map, offset, epoch)
+
+            for index in self._indexes(digest):
+                position = offset + self._SLOT_HEADER.size + (index >> 3)
+                self._map[position] |= 1 << (index & 7)
+
+    async def is_revoked(self, mac, valid_until):
+        """Returns true if the ticket has been revoked.
+
+        Args:
+            mac: String or bytes identifying the MAC of the ticket to check,
+                as passed to revoke().
+            valid_until: Expiration time of the ticket.
+        """
+        epoch = int(valid_until) // self._span
+        offset = self._slot_offset(epoch)
+        current, = self._SLOT_HEADER.unpack_from(self._map, offset)
+        if current != epoch:
+            return False
+
+        digest = self._digest(mac, valid_until)
+        for index in self._indexes(digest):
+            position = offset + self._SLOT_HEADER.size + (index >> 3)
+            if not self._map[position] & (1 << (index & 7)):
+                return False
+
+        # Confirm the hit, since it may be a false positive
+        return (await self._store.get(digest.hex())) is not None
+
+    def _open(self):
+        size = self._HEADER.size + self._slots * self._slot_size
+        header = self._HEADER.pack(self._MAGIC, self._slots, self._bits,
+                                   self._hashes, self._span)
+
+        with _FileLock(self._fd):
+            existing = os.read(self._fd, self._HEADER.size)
+            if existing and existing != header:
+                raise ValueError('Revocation filter file was created with '
+                                 'different parameters')
+
+            if not existing:
+                os.ftruncate(self._fd, size)
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                os.write(self._fd, header)
+
+        return mmap.mmap(self._fd, size)
+
+    def _slot_offset(self, epoch):
+        return self._HEADER.size + (epoch % self._slots) * self._slot_size
+
+    def _digest(self, mac, valid_until):
+        if isinstance(mac, str):
+            mac = mac.encode('ascii')
+
+        valid_until = struct.pack('>Q', int(valid_until))
+        return hashlib.sha256(mac + valid_until).digest()
+
+    def _indexes(self, digest):
+        # Double hashing: index i = h1 + i * h2
+        h1, h2 = struct.unpack_from('>QQ', digest)
+        h2 |= 1
+        return ((h1 + i * h2) % self._bits for i in range(self._hashes))
+
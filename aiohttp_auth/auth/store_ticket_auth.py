@@ -0,0 +1,127 @@
+import os
+from base64 import urlsafe_b64encode
+from .cookie_ticket_auth import CookieTktAuthentication
+from .ticket_store import MemoryTicketStore
+from ..state import get_state
+
+# Length of the random ticket ids stored in the cookie
+_TICKET_ID_BYTES = 18
+
+
+"""Key used to store the ticket id of the request in the request object"""
+TICKET_ID_KEY = 'aiohttp_auth.auth.ticket_id'
+
+
+class StoreTktAuthentication(CookieTktAuthentication):
+    """Ticket authentication mechanism based on the ticket_auth library, with
+    ticket data being stored server side in a ticket store.
+
+    The client only receives a short random ticket id as a cookie, which is
+    used to look up the ticket in the store. Forgetting a user deletes the
+    ticket from the store, so the ticket id cannot be used again even if it
+    was copied from the client.
+    """
+
+    def __init__(self, secret, max_age, *args, store=None, **kwargs):
+        """Initializes the ticket authentication mechanism.
+
+        Takes the same arguments as TktAuthentication, plus:
+
+        Args:
+            store: Object with a base class of AbstractTicketStore, used to
+                store the tickets. Defaults to a MemoryTicketStore.
+        """
+        super().__init__(secret, max_age, *args, **kwargs)
+        self._store = MemoryTicketStore() if store is None else store
+
+    @property
+    def store(self):
+        """Returns the ticket store used by the policy"""
+        return self._store
+
+    async def remember(self, request, user_id):
+        """Called to store the userid for a request.
+
+        A new ticket id is always generated when a user is remembered, and
+        the ticket held under the previous ticket id of the request (if any)
+        is deleted from the store, so a ticket id from a previous session can
+        never be reused or replayed.
+
+        Args:
+            request: aiohttp Request object.
+            user_id: String representing the user_id to remember
+        """
+        ticket_id = request.pop(TICKET_ID_KEY, None)
+        if ticket_id is None:
+            ticket_id = await super().get_ticket(request)
+
+        if ticket_id:
+            await self._store.delete(ticket_id)
+
+        await super().remember(request, user_id)
+
+    async def remember_ticket(self, request, ticket):
+        """Called to store the ticket data for a request.
+
+        The ticket is stored in the ticket store, and the ticket id is written
+        as a cookie to the response if the client does not already hold it.
+
+        Args:
+            request: aiohttp Request object.
+            ticket: String like object representing the ticket to be stored.
+        """
+        ticket_id = request.get(TICKET_ID_KEY)
+        if ticket_id is None:
+            ticket_id = urlsafe_b64encode(
+                os.urandom(_TICKET_ID_BYTES)).decode('ascii')
+            request[TICKET_ID_KEY] = ticket_id
+            get_state(request).cookie = ticket_id
+
+        await self._store.set(ticket_id, ticket, self._max_age)
+
+    async def forget_ticket(self, request):
+        """Called to forget the ticket data a request.
+
+        The ticket is deleted from the store, and the cookie deleted from the
+        client.
+
+        Args:
+            request: aiohttp Request object.
+        """
+        ticket_id = request.pop(TICKET_ID_KEY, None)
+        if ticket_id is None:
+            ticket_id = await super().get_ticket(request)
+
+        if ticket_id is not None:
+            await self._store.delete(ticket_id)
+
+        get_state(request).cookie = ''
+
+    async def has_credentials(self, request):
+        """Returns true if the request carries a ticket id cookie, without
+        looking the ticket up in the store.
+
+        Args:
+            request: aiohttp Request object.
+        """
+        return bool(await super().get_ticket(request))
+
+    async def get_ticket(self, request):
+        """Called to return the ticket for a request.
+
+        Args:
+            request: aiohttp Request object.
+
+        Returns:
+            The ticket held in the store for the ticket id in the request
+            cookie, or None if there is no cookie or ticket.
+        """
+        ticket_id = await super().get_ticket(request)
+        if not ticket_id or len(ticket_id) > 64:
+            return None
+
+        ticket = await self._store.get(ticket_id)
+        if ticket is not None:
+            request[TICKET_ID_KEY] = ticket_id
+
+        return ticket
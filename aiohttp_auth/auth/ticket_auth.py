@@ -1,12 +1,24 @@
 import abc
 import time
 from ipaddress import ip_address
-from ticket_auth import TicketFactory, TicketError
+from ticket_auth import (
+    TicketFactory,
+    TicketError,
+    TicketParseError,
+    TicketDigestError,
+    TicketExpired)
 from .abstract_auth import AbstractAuthentication
+from .compact_ticket import CompactTicketFactory
+from ..cache import LRUCache
+from ..shared_cache import TieredCache
+from ..state import STATE_KEY, get_state
+from ..instrumentation import clock
 from aiohttp import web
 
 
-_REISSUE_KEY = 'aiohttp_auth.auth.TktAuthentication.reissue'
+# Validation outcomes recorded as failures by the rate limiter. Expired
+# tickets are left out, since browsers keep sending them until replaced.
+_FAILED_OUTCOMES = frozenset(('bad_signature', 'invalid', 'revoked'))
 
 
 class TktAuthentication(AbstractAuthentication):
@@ -24,11 +36,23 @@ class TktAuthentication(AbstractAuthentication):
             max_age,
             reissue_time=None,
             include_ip=False,
-            cookie_name='AUTH_TKT'):
+            cookie_name='AUTH_TKT',
+            cache_size=1024,
+            cache_ttl=60,
+            reissue_interval=None,
+            reissue_cache_size=1024,
+            ticket_format='hex',
+            revocation=None,
+            shared_cache=None):
         """Initializes the ticket authentication mechanism.
 
         Args:
-            secret: Byte sequence used to initialize the ticket factory.
+            secret: Byte sequence used to initialize the ticket factory, or
+                a keyring (a list or tuple of byte sequences) ordered from the
+                current secret to the oldest retired secret. New tickets are
+                always signed with the current secret. Tickets signed with a
+                retired secret remain valid, and are reissued with the current
+                secret on the next successful response.
             max_age: Integer representing the number of seconds to allow the
                 ticket to remain valid for after being issued.
             reissue_time: Integer representing the number of seconds before
@@ -40,8 +64,58 @@ class TktAuthentication(AbstractAuthentication):
             include_ip: If true, requires the clients ip details when
                 calculating the ticket hash
             cookie_name: Name to use to reference the ticket details.
+            cache_size: Maximum number of validated tickets to cache, so that
+                repeated requests with the same ticket do not validate it
+                again. If 0, validated tickets are not cached.
+            cache_ttl: Maximum number of seconds a validated ticket is cached
+                for. Tickets are never cached past their expiration time.
+            reissue_interval: Optional minimum number of seconds between
+                tickets issued for the same user_id and client ip. Requests
+                within the interval that require a reissued ticket share the
+                most recently issued one, and no cookie is set if the client
+                already holds it. Useful when reissue_time is small. Must be
+                less than max_age - reissue_time (or max_age if reissue_time
+                is None), so a shared ticket never expires while it is handed
+                out.
+            reissue_cache_size: Maximum number of recently issued tickets to
+                keep when reissue_interval is set.
+            ticket_format: Format of the tickets issued, either 'hex' for
+                ticket_auth (mod_auth_tkt style) tickets, or 'compact' for the
+                shorter binary tickets of CompactTicketFactory. When
+                'compact' is used, existing 'hex' tickets remain valid and
+                are reissued as compact tickets.
+            revocation: Optional RevocationFilter object. If passed, the
+                ticket of the request is revoked when the user is forgotten,
+                and revoked tickets are rejected until they expire (even by
+                other processes sharing the filter).
+            shared_cache: Optional SharedCache object (see
+                aiohttp_auth.shared_cache.open_shared_cache) holding validated
+                tickets for every process on the host, behind the per process
+                cache. If None, validated tickets are only cached per process.
+
+        Raises:
+            ValueError: If the keyring is empty, the ticket format is unknown,
+                or reissue_interval is too long for max_age and reissue_time.
         """
-        self._ticket = TicketFactory(secret)
+        if isinstance(secret, (list, tuple)):
+            if not secret:
+                raise ValueError(
+                    'The keyring must contain at least one secret')
+            secret, *retired = secret
+        else:
+            retired = []
+
+        if ticket_format == 'hex':
+            self._ticket = TicketFactory(secret)
+            self._retired_tickets = tuple(TicketFactory(s) for s in retired)
+        elif ticket_format == 'compact':
+            self._ticket = CompactTicketFactory(secret)
+            self._retired_tickets = tuple(
+                [CompactTicketFactory(s) for s in retired] +
+                [TicketFactory(s) for s in [secret] + retired])
+        else:
+            raise ValueError(
+                'Unknown ticket format {!r}'.format(ticket_format))
         self._max_age = max_age
         if (self._max_age is not None and
             reissue_time is not None and
@@ -53,6 +127,32 @@ class TktAuthentication(AbstractAuthentication):
         self._include_ip = include_ip
         self._cookie_name = cookie_name
 
+        # Only successfully validated tickets are cached. Lookups hash the
+        # full ticket string (including its digest) with Python's randomized
+        # string hash, so a forged ticket can only ever miss the cache and
+        # fall through to full validation. The shared cache hashes keys with
+        # a 128 bit digest, so the same holds across processes.
+        self._cache = shared_cache
+        if cache_size:
+            self._cache = LRUCache(cache_size, clock=time.time)
+            if shared_cache is not None:
+                self._cache = TieredCache(self._cache, shared_cache)
+        self._cache_ttl = cache_ttl
+
+        self._revocation = revocation
+
+        self._issued = None
+        if reissue_interval:
+            # Tickets are shared for up to reissue_interval seconds, so they
+            # must remain valid (and not due for reissue) for longer
+            limit = max_age if self._reissue_time is None else \
+                self._reissue_time
+            if max_age is not None and reissue_interval >= limit:
+                raise ValueError('reissue_interval must be less than '
+                                 'max_age - reissue_time')
+
+            self._issued = LRUCache(reissue_cache_size, reissue_interval)
+
     @property
     def cookie_name(self):
         """Returns the name of the cookie stored in the session"""
@@ -62,31 +162,46 @@ class TktAuthentication(AbstractAuthentication):
         """Called to store the userid for a request.
 
         This function creates a ticket from the request and user_id, and calls
-        the abstract function remember_ticket() to store the ticket.
+        the abstract function remember_ticket() to store the ticket. Any
+        reissue of the previous ticket pending for the request is dropped.
 
         Args:
             request: aiohttp Request object.
             user_id: String representing the user_id to remember
         """
+        get_state(request).reissue = None
         ticket = self._new_ticket(request, user_id)
+        if self._issued is not None:
+            self._issued.set((user_id, self._get_ip(request)), ticket)
+
         await self.remember_ticket(request, ticket)
 
     async def forget(self, request):
         """Called to forget the userid for a request
 
         This function calls the forget_ticket() function to forget the ticket
-        associated with this request.
+        associated with this request. If a revocation filter is used, the
+        ticket is revoked as well. Any reissue pending for the request is
+        dropped, so the response never hands a ticket back to the client.
 
         Args:
             request: aiohttp Request object
         """
+        get_state(request).reissue = None
+        if self._revocation is not None:
+            await self._revoke(request)
+
         await self.forget_ticket(request)
 
     async def get(self, request):
         """Gets the user_id for the request.
 
         Gets the ticket for the request using the get_ticket() function, and
-        authenticates the ticket.
+        authenticates the ticket. Forged, malformed and revoked tickets are
+        recorded as failures by the rate limiter of auth_middleware, if any,
+        and forgotten with forget_ticket(), so a client holding a stale
+        ticket (for example after the secret was rotated) is only counted
+        once rather than on every request.
 
         Args:
             request: aiohttp Request object.
@@ -95,38 +210,89 @@ class TktAuthentication(AbstractAuthentication):
             The userid for the request, or None if the ticket is not
             authenticated.
         """
-        ticket = await self.get_ticket(request)
-        if ticket is None:
-            return None
+        settings = get_state(request).auth
+        observer = None if settings is None else settings.observer
+        if observer is None:
+            user_id, outcome = await self._get(request)
+        else:
+            start = clock()
+            user_id, outcome = await self._get(request)
+            observer.observe('ticket.validate', outcome, clock() - start)
 
-        try:
-            # Returns a tuple of (user_id, token, userdata, validuntil)
-            now = time.time()
-            fields = self._ticket.validate(ticket, self._get_ip(request), now)
+        if (outcome in _FAILED_OUTCOMES and settings is not None and
+                settings.rate_limiter is not None):
+            settings.rate_limiter.record_ticket_failure(request)
+            await self.forget_ticket(request)
 
-            # Check if we need to reissue a ticket
-            if (self._reissue_time is not None and
-                now >= (fields.valid_until - self._reissue_time)):
+        return user_id
 
-                # Reissue our ticket, and save it in our request.
-                request[_REISSUE_KEY] = self._new_ticket(request, fields.user_id)
+    async def _get(self, request):
+        """Returns a tuple of the user_id for the request (or None), and the
+        instrumentation outcome of the ticket validation"""
+        ticket = await self.get_ticket(request)
+        if ticket is None:
+            return None, 'no_ticket'
 
-            return fields.user_id
+        now = time.time()
+        ip = self._get_ip(request)
+        key = ticket if ip is None else (ticket, ip)
 
-        except TicketError as e:
-            return None
+        cached = None if self._cache is None else self._cache.get(key, None)
+        if cached is not None:
+            user_id, mac, valid_until, retired = cached
+            outcome = 'cached'
+        else:
+            try:
+                # Returns a tuple of (user_id, token, userdata, validuntil)
+                fields, retired = self._validate(ticket, ip, now)
+            except TicketExpired:
+                return None, 'expired'
+            except TicketDigestError:
+                return None, 'bad_signature'
+            except TicketError:
+                return None, 'invalid'
+
+            user_id, mac, valid_until = \
+                fields.user_id, _mac_id(fields.digest), fields.valid_until
+            outcome = 'valid'
+            if self._cache is not None:
+                ttl = valid_until - now
+                if self._cache_ttl is not None:
+                    ttl = min(ttl, self._cache_ttl)
+
+                self._cache.set(
+                    key, (user_id, mac, valid_until, retired), ttl)
+
+        if (self._revocation is not None and
+            await self._revocation.is_revoked(mac, valid_until)):
+            return None, 'revoked'
+
+        # Check if we need to reissue a ticket (tickets signed with a retired
+        # secret are always reissued)
+        if retired or (self._reissue_time is not None and
+                       now >= (valid_until - self._reissue_time)):
+
+            # Reissue our ticket, and save it in our request (unless the
+            # client already holds the ticket issued in this interval)
+            reissued = self._reissue_ticket(request, user_id, ip)
+            if self._issued is None or reissued != ticket:
+                get_state(request).reissue = reissued
+                outcome = 'reissued'
+
+        return user_id, outcome
 
     async def process_response(self, request, response):
         """If a reissue was requested, only reiisue if the response was a
         valid 2xx response
         """
-        if _REISSUE_KEY in request:
-            if (response.started or
+        state = request.get(STATE_KEY)
+        if state is not None and state.reissue is not None:
+            if (response.prepared or
                 not isinstance(response, web.Response) or
                 response.status < 200 or response.status > 299):
                 return
 
-            await self.remember_ticket(request, request[_REISSUE_KEY])
+            await self.remember_ticket(request, state.reissue)
 
     @abc.abstractmethod
     async def remember_ticket(self, request, ticket):
@@ -160,6 +326,68 @@ class TktAuthentication(AbstractAuthentication):
         """
         pass
 
+    async def has_credentials(self, request):
+        """Returns true if the request carries a ticket, whether valid or not.
+
+        Args:
+            request: aiohttp Request object.
+        """
+        return (await self.get_ticket(request)) is not None
+
+    async def _revoke(self, request):
+        """Revokes the ticket of the request, if it is valid, and drops any
+        reissue of it pending for the request"""
+        get_state(request).reissue = None
+        ticket = await self.get_ticket(request)
+        if ticket is None:
+            return
+
+        ip = self._get_ip(request)
+        try:
+            fields, retired = self._validate(ticket, ip, time.time())
+        except TicketError:
+            return
+
+        await self._revocation.revoke(_mac_id(fields.digest),
+                                      fields.valid_until)
+        if self._cache is not None:
+            self._cache.pop(ticket if ip is None else (ticket, ip))
+
+    def _reissue_ticket(self, request, user_id, ip):
+        """Returns a new ticket for the user_id, or the ticket recently issued
+        for the user_id and ip if reissue_interval is set"""
+        if self._issued is None:
+            return self._new_ticket(request, user_id)
+
+        key = (user_id, ip)
+        ticket = self._issued.get(key, None)
+        if ticket is None:
+            ticket = self._new_ticket(request, user_id)
+            self._issued.set(key, ticket)
+
+        return ticket
+
+    def _validate(self, ticket, ip, now):
+        """Validates the ticket against the current secret and format,
+        falling back to the retired secrets of the keyring (and the hex
+        format when issuing compact tickets). Returns a tuple of the ticket
+        fields, and a flag which is true if the ticket needs to be reissued
+        with the current secret and format."""
+        try:
+            return self._ticket.validate(ticket, ip, now), False
+        except (TicketDigestError, TicketParseError) as e:
+            error = e
+
+        for factory in self._retired_tickets:
+            try:
+                return factory.validate(ticket, ip, now), True
+            except (TicketDigestError, TicketParseError) as e:
+                # Report a digest error over a parse error in another format
+                if isinstance(error, TicketParseError):
+                    error = e
+
+        raise error
+
     def _get_ip(self, request):
         ip = None
         if self._include_ip:
@@ -173,3 +401,14 @@ class TktAuthentication(AbstractAuthentication):
         ip = self._get_ip(request)
         valid_until = int(time.time()) + self._max_age
         return self._ticket.new(user_id, valid_until=valid_until, client_ip=ip)
+
+
+def _mac_id(digest):
+    """Returns the first 128 bits of the MAC parsed from a ticket (a hex
+    string for ticket_auth tickets, bytes for compact tickets) as a hex
+    string, which identifies the ticket however it was encoded and is small
+    enough to be held in a shared cache entry"""
+    if isinstance(digest, bytes):
+        digest = digest.hex()
+
+    return digest[:32]
@@ -0,0 +1,270 @@
+import abc
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ..cache import LRUCache
+
+
+class AbstractTicketStore(object):
+    """Abstract asynchronous key/value store for tickets held server side"""
+
+    @abc.abstractmethod
+    async def get(self, key):
+        """Abstract function called to get the ticket stored under key.
+
+        Args:
+            key: String key the ticket was stored under.
+
+        Returns:
+            The ticket, or None if there is no (unexpired) ticket for the key.
+        """
+        pass
+
+    @abc.abstractmethod
+    async def set(self, key, ticket, ttl):
+        """Abstract function called to store a ticket.
+
+        Args:
+            key: String key to store the ticket under.
+            ticket: String like ticket to store.
+            ttl: Number of seconds the ticket should be stored for.
+        """
+        pass
+
+    @abc.abstractmethod
+    async def delete(self, key):
+        """Abstract function called to delete the ticket stored under key.
+
+        Args:
+            key: String key the ticket was stored under.
+        """
+        pass
+
+    async def close(self):
+        """Called to release any resources held by the store.
+
+        Default implementation does nothing.
+        """
+        pass
+
+
+class MemoryTicketStore(AbstractTicketStore):
+    """Ticket store holding the tickets in a bounded in-process LRU cache.
+
+    Tickets are only visible to the process that stored them, so this store
+    is only suitable for applications running as a single process.
+    """
+
+    def __init__(self, maxsize=10000):
+        """Initializes the store.
+
+        Args:
+            maxsize: Maximum number of tickets held by the store. The least
+                recently used tickets are discarded (logging the user out)
+                when the store is full.
+        """
+        self._cache = LRUCache(maxsize)
+
+    async def get(self, key):
+        return self._cache.get(key, None)
+
+    async def set(self, key, ticket, ttl):
+        self._cache.set(key, ticket, ttl)
+
+    async def delete(self, key):
+        self._cache.pop(key)
+
+
+class SQLiteTicketStore(AbstractTicketStore):
+    """Ticket store holding the tickets in a SQLite database file.
+
+    The database file can be shared by all the worker processes on a host.
+    Database operations run in a thread pool, with a pool of connections (one
+    per thread). Operations issued during the same event loop iteration are
+    batched: concurrent reads are answered by a single query, and writes are
+    committed together in a single transaction. Reads always see the writes
+    issued earlier by this process, even before they are committed.
+    """
+
+    def __init__(self, path, pool_size=2, executor=None):
+        """Initializes the store.
+
+        Args:
+            path: Path of the SQLite database file, created if required.
+            pool_size: Maximum number of database connections (and threads)
+                used by the store.
+            executor: Optional concurrent.futures executor to run the
+                database operations in. Defaults to a thread pool of
+                pool_size threads.
+        """
+        self._path = path
+        self._pool = queue.LifoQueue()
+        self._pool_size = pool_size
+        self._connections = 0
+        self._lock = threading.Lock()
+        self._executor = executor or ThreadPoolExecutor(pool_size)
+        self._owns_executor = executor is None
+
+        # Reads waiting for the next batch: key -> future
+        self._reads = {}
+
+        # Writes waiting for the next batch, and the batch being committed:
+        # key -> (ticket or None to delete, expiry time)
+        self._writes = {}
+        self._committing = {}
+        self._commit_task = None
+        self._write_future = None
+
+    async def get(self, key):
+        for writes in (self._writes, self._committing):
+            write = writes.get(key)
+            if write is not None:
+                ticket, expires = write
+                return ticket if expires > time.time() else None
+
+        future = self._reads.get(key)
+        if future is None:
+            loop = asyncio.get_event_loop()
+            if not self._reads:
+                loop.call_soon(self._flush_reads, loop)
+
+            future = self._reads[key] = loop.create_future()
+
+        return await asyncio.shield(future)
+
+    async def set(self, key, ticket, ttl):
+        await self._write(key, ticket, time.time() + ttl)
+
+    async def delete(self, key):
+        await self._write(key, None, 0)
+
+    async def close(self):
+        if self._write_future is not None:
+            await asyncio.shield(self._write_future)
+        if self._committing:
+            await asyncio.shield(self._commit_task)
+
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+        if self._owns_executor:
+            self._executor.shutdown(wait=False)
+
+    async def _write(self, key, ticket, expires):
+        loop = asyncio.get_event_loop()
+        if self._write_future is None:
+            self._write_future = loop.create_future()
+            loop.call_soon(self._flush_writes, loop)
+
+        self._writes[key] = (ticket, expires)
+        await asyncio.shield(self._write_future)
+
+    def _flush_reads(self, loop):
+        reads, self._reads = self._reads, {}
+        task = loop.run_in_executor(self._executor, self._select, list(reads))
+
+        def _done(task):
+            error = task.exception()
+            for key, future in reads.items():
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(task.result().get(key))
+
+        task.add_done_callback(_done)
+
+    def _flush_writes(self, loop):
+        if self._committing:
+            # Wait for the batch in flight to commit, keeping the order of
+            # writes to the same key
+            self._commit_task.add_done_callback(
+                lambda task: self._flush_writes(loop))
+            return
+
+        writes, self._writes = self._writes, {}
+        future, self._write_future = self._write_future, None
+        self._committing = writes
+        self._commit_task = loop.run_in_executor(
+            self._executor, self._commit, list(writes.items()))
+
+        def _done(task):
+            self._committing = {}
+            error = task.exception()
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(None)
+
+        self._commit_task.add_done_callback(_done)
+
+    def _select(self, keys):
+        tickets = {}
+        now = time.time()
+        with self._connection() as db:
+            # Stay well below SQLite's limit on the number of query parameters
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = db.execute(
+                    'SELECT key, ticket FROM tickets WHERE key IN ({}) '
+                    'AND expires > ?'.format(','.join('?' * len(chunk))),
+                    chunk + [now])
+                tickets.update(rows.fetchall())
+
+        return tickets
+
+    def _commit(self, writes):
+        with self._connection() as db:
+            with db:
+                db.executemany(
+                    'INSERT OR REPLACE INTO tickets (key, ticket, expires) '
+                    'VALUES (?, ?, ?)',
+                    [(k, t, e) for k, (t, e) in writes if t is not None])
+                db.executemany(
+                    'DELETE FROM tickets WHERE key = ?',
+                    [(k,) for k, (t, e) in writes if t is None])
+                db.execute('DELETE FROM tickets WHERE expires <= ?',
+                           (time.time(),))
+
+    def _connection(self):
+        return _PooledConnection(self)
+
+    def _acquire(self):
+        with self._lock:
+            create = self._pool.empty() and self._connections < self._pool_size
+            if create:
+                self._connections += 1
+
+        if not create:
+            return self._pool.get()
+
+        db = sqlite3.connect(self._path, timeout=30, check_same_thread=False)
+        with db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS tickets ('
+                       'key TEXT PRIMARY KEY, ticket TEXT, expires REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS tickets_expires '
+                       'ON tickets (expires)')
+        return db
+
+
+class _PooledConnection(object):
+    """Context manager borrowing a connection from the store's pool"""
+
+    def __init__(self, store):
+        self._store = store
+        self._db = None
+
+    def __enter__(self):
+        self._db = self._store._acquire()
+        return self._db
+
+    def __exit__(self, *exc_info):
+        self._store._pool.put(self._db)
@@ -0,0 +1,149 @@
+import time
+from collections import OrderedDict
+
+
+"""Sentinel returned by LRUCache.get() when a key is not cached"""
+MISSING = object()
+
+
+class LRUCache(object):
+    """Bounded in-process cache with least recently used eviction and per
+    entry expiry.
+
+    The cache keeps hit, miss and eviction counters, which can be used to
+    size the cache for a particular deployment. Entries that expire are
+    counted as misses, not evictions.
+
+    Loads of values which may be popped while they are in flight should be
+    bracketed by begin_load() and end_load(), so a value loaded before the
+    key was popped is not cached afterwards.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        """Initializes the cache.
+
+        Args:
+            maxsize: Maximum number of entries held by the cache.
+            ttl: Default number of seconds an entry remains valid for, or None
+                if entries do not expire.
+            clock: Function returning the current time in seconds, used to
+                expire entries.
+        """
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._loads = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def maxsize(self):
+        """Returns the maximum number of entries held by the cache"""
+        return self._maxsize
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not MISSING
+
+    def get(self, key, default=MISSING):
+        """Returns the value cached for key.
+
+        Args:
+            key: Hashable key of the entry.
+            default: Value returned if the key is not cached or has expired.
+
+        Returns:
+            The cached value, or default.
+        """
+        entry = self._data.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires is None or self._clock() < expires:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+
+            del self._data[key]
+
+        self.misses += 1
+        return default
+
+    def set(self, key, value, ttl=None):
+        """Caches a value, evicting the least recently used entry if the
+        cache is full.
+
+        Args:
+            key: Hashable key of the entry.
+            value: Value to store (may be None).
+            ttl: Number of seconds the entry remains valid for, overriding
+                the ttl passed to the constructor.
+        """
+        if ttl is None:
+            ttl = self._ttl
+
+        expires = None if ttl is None else self._clock() + ttl
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+
+        if len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        """Removes the entry for key, returning its value or default"""
+        load = self._loads.get(key)
+        if load is not None:
+            load[1] += 1
+
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        """Removes all entries from the cache"""
+        for load in self._loads.values():
+            load[1] += 1
+
+        self._data.clear()
+
+    def begin_load(self, key):
+        """Marks a load of the value for key as in flight.
+
+        Args:
+            key: Hashable key of the entry being loaded.
+
+        Returns:
+            The generation of key, to pass to end_load() once the load
+            completes (or fails).
+        """
+        load = self._loads.get(key)
+        if load is None:
+            # Number of loads in flight and generation of the key
+            load = self._loads[key] = [0, 0]
+
+        load[0] += 1
+        return load[1]
+
+    def end_load(self, key, generation):
+        """Marks a load of the value for key as completed.
+
+        Args:
+            key: Hashable key of the entry loaded.
+            generation: Generation returned by begin_load().
+
+        Returns:
+            True if key was not popped while the load was in flight, so the
+            value loaded may be cached.
+        """
+        load = self._loads[key]
+        load[0] -= 1
+        if load[0] == 0:
+            del self._loads[key]
+
+        return load[1] == generation
@@ -0,0 +1,247 @@
+import asyncio
+import hashlib
+import hmac
+import os
+from base64 import b64encode, b64decode
+from binascii import Error as BinasciiError
+from concurrent.futures import ThreadPoolExecutor
+
+
+"""Maximum number of PBKDF2 iterations of a hash that can be verified"""
+PBKDF2_MAX_ITERATIONS = 10 ** 7
+
+"""Maximum memory in bytes used by the scrypt parameters of a hash that can be
+verified (about 128 * r * (n + p))"""
+SCRYPT_MAX_MEMORY = 128 * 1024 * 1024
+
+"""Maximum scrypt parallelization of a hash that can be verified"""
+SCRYPT_MAX_PARALLELIZATION = 16
+
+
+class CredentialsBusyError(RuntimeError):
+    """Raised when too many password hashes are already queued"""
+    pass
+
+
+class PasswordHasher(object):
+    """Hashes and verifies passwords without blocking the event loop.
+
+    Passwords are hashed with the PBKDF2 (HMAC-SHA256) or scrypt functions of
+    hashlib in an executor, so a burst of logins does not stall the other
+    requests handled by the event loop. At most max_concurrency hashes run at
+    once, and at most max_queue more wait for their turn. Further calls raise
+    CredentialsBusyError, which applications should turn into an error
+    response (such as 503 Service Unavailable) instead of queueing work
+    indefinitely.
+
+    Hashes are encoded as strings holding the algorithm, its parameters, the
+    salt and the derived key separated by '$' characters, for example
+    'pbkdf2_sha256$600000$<salt>$<key>'. Stored hashes whose parameters are
+    out of bounds (see PBKDF2_MAX_ITERATIONS, SCRYPT_MAX_MEMORY and
+    SCRYPT_MAX_PARALLELIZATION) are treated as malformed, so a corrupt or
+    hostile hash cannot exhaust the executor.
+    """
+
+    ALGORITHMS = ('pbkdf2_sha256', 'scrypt')
+
+    def __init__(self, algorithm='pbkdf2_sha256', iterations=600000,
+                 scrypt_n=2 ** 14, scrypt_r=8, scrypt_p=1, salt_size=16,
+                 max_password_length=1024, max_concurrency=4, max_queue=64,
+                 executor=None):
+        """Initializes the password hasher.
+
+        Args:
+            algorithm: Algorithm used to hash new passwords, either
+                'pbkdf2_sha256' or 'scrypt'. Hashes produced by either
+                algorithm can always be verified.
+            iterations: Number of PBKDF2 iterations for new hashes.
+            scrypt_n: scrypt CPU/memory cost for new hashes.
+            scrypt_r: scrypt block size for new hashes.
+            scrypt_p: scrypt parallelization for new hashes.
+            salt_size: Number of random bytes in the salt of new hashes.
+            max_password_length: Passwords longer than this many characters
+                are rejected without being hashed.
+            max_concurrency: Maximum number of hashes computed at once.
+            max_queue: Maximum number of hashes waiting for one of the
+                max_concurrency slots.
+            executor: Optional concurrent.futures executor to hash passwords
+                in, such as a ProcessPoolExecutor. Defaults to a thread pool
+                of max_concurrency threads (hashlib releases the GIL while
+                hashing).
+
+        Raises:
+            ValueError: If the algorithm is unknown, or its parameters are out
+                of bounds.
+        """
+        if algorithm not in self.ALGORITHMS:
+            raise ValueError('Unknown algorithm {!r}'.format(algorithm))
+
+        self._algorithm = algorithm
+        if algorithm == 'scrypt':
+            self._params = (scrypt_n, scrypt_r, scrypt_p)
+        else:
+            self._params = (iterations,)
+
+        if not _valid_params(algorithm, self._params):
+            raise ValueError('Invalid {} parameters'.format(algorithm))
+
+        self._salt_size = salt_size
+        self._max_password_length = max_password_length
+        self._max_concurrency = max_concurrency
+        self._max_pending = max_concurrency + max_queue
+        self._pending = 0
+        self._semaphore = None
+        self._executor = executor or ThreadPoolExecutor(max_concurrency)
+        self._dummy_hash = '$'.join(
+            [algorithm] + [str(p) for p in self._params] +
+            [_encode(os.urandom(salt_size)), _encode(os.urandom(32))])
+
+    @property
+    def pending(self):
+        """Returns the number of hashes running or waiting to run"""
+        return self._pending
+
+    @property
+    def dummy_hash(self):
+        """Returns an encoded hash which no password matches, with the
+        algorithm and parameters of this hasher. Verifying a password against
+        it when a user is unknown takes as long as for a known user."""
+        return self._dummy_hash
+
+    async def hash(self, password):
+        """Hashes a password with a new random salt.
+
+        Args:
+            password: Password string to hash.
+
+        Returns:
+            The encoded hash string, to be stored by the application.
+
+        Raises:
+            CredentialsBusyError: If too many hashes are queued.
+        """
+        salt = os.urandom(self._salt_size)
+        key = await self._derive(self._algorithm, self._params,
+                                 password.encode('utf-8'), salt)
+        return '$'.join([self._algorithm] +
+                        [str(p) for p in self._params] +
+                        [_encode(salt), _encode(key)])
+
+    async def verify(self, password, encoded):
+        """Verifies a password against an encoded hash.
+
+        The derived key is compared in constant time. A missing hash (None,
+        typically for an unknown user) is verified against dummy_hash, so it
+        takes as long as a known user. Malformed hashes, and passwords that
+        are empty or too long, are rejected without hashing the password.
+
+        Args:
+            password: Password string to verify.
+            encoded: Encoded hash returned by hash(), or None.
+
+        Returns:
+            True if the password matches the hash.
+
+        Raises:
+            CredentialsBusyError: If too many hashes are queued.
+        """
+        if not password or len(password) > self._max_password_length:
+            return False
+
+        parsed = _parse(self._dummy_hash if encoded is None else encoded)
+        if parsed is None:
+            return False
+
+        algorithm, params, salt, expected = parsed
+        try:
+            key = await self._derive(algorithm, params,
+                                     password.encode('utf-8'), salt)
+        except ValueError:
+            # Parameters hashlib rejects, or its memory limit is exceeded
+            return False
+
+        return encoded is not None and hmac.compare_digest(key, expected)
+
+    def needs_rehash(self, encoded):
+        """Returns true if the encoded hash was not produced with the
+        algorithm and parameters of this hasher, so the password should be
+        hashed again (typically after a successful login)"""
+        parsed = _parse(encoded)
+        return (parsed is None or parsed[0] != self._algorithm or
+                parsed[1] != self._params or
+                len(parsed[2]) != self._salt_size)
+
+    def close(self):
+        """Shuts down the executor"""
+        self._executor.shutdown(wait=False)
+
+    async def _derive(self, algorithm, params, password, salt):
+        if self._pending >= self._max_pending:
+            raise CredentialsBusyError('Too many password hashes queued')
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        self._pending += 1
+        try:
+            async with self._semaphore:
+                loop = asyncio.get_event_loop()
+                return await loop.run_in_executor(
+                    self._executor, _derive_key, algorithm, params, password,
+                    salt)
+        finally:
+            self._pending -= 1
+
+
+def _derive_key(algorithm, params, password, salt):
+    """Derives the key of a password, run in the executor (at module level so
+    it can be used with a ProcessPoolExecutor)"""
+    if algorithm == 'scrypt':
+        n, r, p = params
+        return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p,
+                              maxmem=128 * r * (n + p + 2) + 1024 * 1024,
+                              dklen=32)
+
+    iterations, = params
+    return hashlib.pbkdf2_hmac('sha256', password, salt, iterations)
+
+
+def _parse(encoded):
+    """Returns a tuple of the algorithm, parameters, salt and key of an
+    encoded hash, or None if the hash is malformed"""
+    fields = encoded.split('$')
+    counts = {'pbkdf2_sha256': 1, 'scrypt': 3}
+    if fields[0] not in counts or len(fields) != counts[fields[0]] + 3:
+        return None
+
+    try:
+        params = tuple(int(p) for p in fields[1:-2])
+        salt, key = _decode(fields[-2]), _decode(fields[-1])
+    except (ValueError, BinasciiError):
+        return None
+
+    if not key or not _valid_params(fields[0], params):
+        return None
+
+    return fields[0], params, salt, key
+
+
+def _valid_params(algorithm, params):
+    """Returns true if the parameters of algorithm are within bounds"""
+    if algorithm == 'scrypt':
+        n, r, p = params
+        # n must be a power of two greater than 1
+        return (n > 1 and n & (n - 1) == 0 and r >= 1 and
+                1 <= p <= SCRYPT_MAX_PARALLELIZATION and
+                128 * r * (n + p) <= SCRYPT_MAX_MEMORY)
+
+    iterations, = params
+    return 1 <= iterations <= PBKDF2_MAX_ITERATIONS
+
+
+def _encode(data):
+    return b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _decode(data):
+    return b64decode(data + '=' * (-len(data) % 4), validate=True)
@@ -0,0 +1,133 @@
+import bisect
+import time
+
+
+"""Clock used to time the instrumented stages"""
+clock = time.perf_counter
+
+
+class Observer(object):
+    """Base class for objects observing the timing of the auth and ACL hot
+    paths.
+
+    An observer is passed to the auth_middleware and/or acl_middleware, and
+    its observe() function is called with the duration and outcome of each
+    stage. The stages and their outcomes are:
+
+        auth.get: authenticated, anonymous
+            Time taken by the policy get() function.
+        auth.process_response: ok
+            Time taken by the policy process_response() function.
+        ticket.validate: no_ticket, cached, valid, reissued, expired,
+            bad_signature, invalid, revoked
+            Time taken to get and validate the ticket of the request in
+            TktAuthentication.get().
+        acl.groups: ok, forbidden
+            Time taken by the acl_middleware groups callback.
+        acl.permitted: allowed, denied
+            Time taken by get_permitted().
+
+    When no observer is installed, the stages are not timed at all.
+    """
+
+    def observe(self, stage, outcome, duration):
+        """Called when a stage completes.
+
+        Args:
+            stage: Name of the stage.
+            outcome: Name of the outcome of the stage.
+            duration: Duration of the stage in seconds.
+        """
+        pass
+
+
+class MetricsObserver(Observer):
+    """Observer aggregating the durations of each stage and outcome into
+    in-memory histograms."""
+
+    # Default histogram bucket upper bounds, in seconds
+    BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+               1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0)
+
+    def __init__(self, buckets=None):
+        """Initializes the aggregator.
+
+        Args:
+            buckets: Optional ascending sequence of bucket upper bounds in
+                seconds. Durations above the last bound are counted in an
+                overflow bucket.
+        """
+        self._buckets = tuple(self.BUCKETS if buckets is None else buckets)
+        self._metrics = {}
+
+    def observe(self, stage, outcome, duration):
+        metric = self._metrics.get((stage, outcome))
+        if metric is None:
+            metric = self._metrics[(stage, outcome)] = \
+                _Histogram(len(self._buckets) + 1)
+
+        metric.count += 1
+        metric.total += duration
+        if duration > metric.max:
+            metric.max = duration
+        metric.counts[bisect.bisect_left(self._buckets, duration)] += 1
+
+    def quantile(self, stage, outcome, q):
+        """Returns an estimate of a quantile of the durations observed.
+
+        Args:
+            stage: Name of the stage.
+            outcome: Name of the outcome.
+            q: Quantile to estimate, between 0 and 1 (0.99 for p99).
+
+        Returns:
+            The upper bound of the histogram bucket containing the quantile
+            (or the maximum duration observed if it is in the overflow
+            bucket), or None if nothing has been observed.
+        """
+        metric = self._metrics.get((stage, outcome))
+        if metric is None:
+            return None
+
+        rank = q * metric.count
+        seen = 0
+        for bound, count in zip(self._buckets, metric.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+
+        return metric.max
+
+    def snapshot(self):
+        """Returns the aggregated metrics.
+
+        Returns:
+            A dict mapping (stage, outcome) tuples to dicts with the count,
+            total and max durations, and a list of (upper bound, count)
+            histogram buckets. The overflow bucket has an upper bound of None.
+        """
+        bounds = self._buckets + (None,)
+        return {
+            key: {
+                'count': metric.count,
+                'total': metric.total,
+                'max': metric.max,
+                'buckets': list(zip(bounds, metric.counts)),
+            }
+            for key, metric in self._metrics.items()
+        }
+
+    def reset(self):
+        """Discards all the aggregated metrics"""
+        self._metrics.clear()
+
+
+class _Histogram(object):
+
+    __slots__ = ('count', 'total', 'max', 'counts')
+
+    def __init__(self, buckets):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.counts = [0] * buckets
@@ -0,0 +1,35 @@
+from .auth.abstract_auth import AbstractAuthentication
+from .auth.auth import _auth_middleware, _middleware_factory
+from .auth.exempt import ExemptRoutes
+from .acl.acl import _acl_prepare, _wrap_callback
+
+
+def auth_acl_middleware(policy, callback, exempt_routes=(), exempt_prefixes=(),
+                        cache=None, coalesce=False, observer=None,
+                        rate_limiter=None, new_style=False, login_routes=()):
+    """Returns a single middleware doing the work of both auth_middleware and
+    acl_middleware, which saves a layer of the handler chain for every
+    request.
+
+    Behaves as auth_middleware(policy, exempt_routes, exempt_prefixes,
+    observer, rate_limiter, login_routes=login_routes) followed by
+    acl_middleware(callback, cache, coalesce, observer), see those functions
+    for the arguments.
+
+    Args:
+        new_style: If true, returns a new style middleware (a coroutine
+            function taking the request and handler) rather than a middleware
+            factory.
+
+    Returns:
+        A aiohttp middleware factory, or a new style middleware.
+    """
+    assert isinstance(policy, AbstractAuthentication)
+    prepare = _acl_prepare(_wrap_callback(callback, cache, coalesce), observer)
+    middleware = _auth_middleware(
+        policy, ExemptRoutes(exempt_routes, exempt_prefixes), observer,
+        rate_limiter, ExemptRoutes(login_routes), prepare)
+    if new_style:
+        return middleware
+
+    return _middleware_factory(middleware)
@@ -0,0 +1,410 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import pickle
+import stat
+import struct
+import time
+from .cache import MISSING
+from .permissions import Group
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Without fcntl, concurrent writers from different processes may lose
+    # writes to the same slot
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class SharedCache(object):
+    """Fixed size hash table held in a memory mapped file, shared by every
+    process on a host that opens the same file.
+
+    The table is used as a cross process tier behind the per process caches
+    (see TieredCache). Keys are hashed to a 128 bit digest, and each key can
+    be held in one of a small window of slots following its hash bucket. When
+    every slot of the window is in use, a slot is evicted using the clock
+    algorithm (slots that were read since the last sweep get a second
+    chance).
+
+    Reads do not take any lock. Each slot is protected by a sequence counter
+    (seqlock) that writers make odd while the slot is being written, so
+    readers retry (or miss) rather than read a partially written entry.
+    Writers are serialized across processes with an advisory file lock.
+
+    Values are encoded as JSON rather than pickled, so a tampered file can at
+    worst produce cache misses or wrong cached values, never run code. Only
+    None, booleans, numbers, strings, tuples (lists are returned as tuples)
+    and Group members can be stored; other values, and values larger than
+    value_size bytes once encoded, are not stored. As cached values are
+    trusted (for example validated tickets), the file must be owned by the
+    user running the application with 0600 permissions, and is rejected
+    otherwise.
+    """
+
+    _MAGIC = b'AASC0001'
+
+    # magic, capacity, value size
+    _HEADER = struct.Struct('>8sII')
+
+    # sequence, referenced, key digest, expires, value length
+    _SLOT = struct.Struct('>IB16sdH')
+
+    # The slot fields following the sequence, written while it is odd
+    _FIELDS = struct.Struct('>B16sdH')
+
+    _SEQUENCE = struct.Struct('>I')
+
+    # Number of slots a key may be stored in, following its bucket
+    _WINDOW = 8
+
+    # Number of attempts to read a slot while it is being written
+    _READ_ATTEMPTS = 4
+
+    def __init__(self, path, capacity=65536, value_size=128):
+        """Opens the shared cache, creating the file if required.
+
+        Args:
+            path: Path of the memory mapped file. Using a file on a memory
+                backed filesystem (such as /dev/shm) avoids disk writes.
+            capacity: Number of slots in the table.
+            value_size: Maximum size in bytes of an encoded value.
+
+        Raises:
+            OSError: If the file cannot be created or mapped, or is not a
+                regular file owned by the current user with 0600
+                permissions.
+            ValueError: If the file exists with different parameters.
+        """
+        self._capacity = capacity
+        self._value_size = value_size
+        self._slot_size = self._SLOT.size + value_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._fd = _open_private(path)
+        try:
+            self._map = self._open()
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    def close(self):
+        """Unmaps and closes the file"""
+        self._map.close()
+        os.close(self._fd)
+
+    def get(self, key, default=MISSING):
+        """Returns the value cached for key, or default"""
+        entry = self.get_entry(key)
+        if entry is None:
+            return default
+
+        return entry[0]
+
+    def get_entry(self, key):
+        """Returns a tuple of the value cached for key and its expiration
+        time (as returned by time.time()), or None if the key is not cached"""
+        digest = self._digest(key)
+        now = time.time()
+        for offset in self._window(digest):
+            slot = self._read(offset)
+            if slot is None or slot[0] != digest:
+                continue
+
+            slot_digest, expires, value = slot
+            if expires <= now:
+                break
+
+            try:
+                value = _decode(value)
+            except (ValueError, KeyError, TypeError):
+                # Corrupt entry, treated as a miss
+                break
+
+            # Benign race, the referenced flag is only a hint for eviction
+            self._map[offset + 4] = 1
+            self.hits += 1
+            return value, expires
+
+        self.misses += 1
+        return None
+
+    def set(self, key, value, ttl):
+        """Caches a value.
+
+        Args:
+            key: Picklable, hashable key of the entry.
+            value: Value to store (may be None), see the class description
+                for the types which can be stored.
+            ttl: Number of seconds the entry remains valid for.
+        """
+        try:
+            data = _encode(value)
+        except TypeError:
+            return
+
+        if len(data) > self._value_size or ttl <= 0:
+            return
+
+        self._write(self._digest(key), time.time() + ttl, data)
+
+    def pop(self, key, default=None):
+        """Removes the entry for key"""
+        self._write(self._digest(key), 0.0, None)
+        return default
+
+    def clear(self):
+        """Removes all entries from the table"""
+        with _FileLock(self._fd):
+            for index in range(self._capacity):
+                offset = self._slot_offset(index)
+                sequence, = self._SEQUENCE.unpack_from(self._map, offset)
+                self._SEQUENCE.pack_into(self._map, offset, sequence + 1)
+                self._FIELDS.pack_into(self._map, offset + 4, 0, bytes(16),
+                                       0.0, 0)
+                self._SEQUENCE.pack_into(self._map, offset, sequence + 2)
+
+    def _open(self):
+        size = self._HEADER.size + self._capacity * self._slot_size
+        header = self._HEADER.pack(self._MAGIC, self._capacity,
+                                   self._value_size)
+
+        with _FileLock(self._fd):
+            existing = os.read(self._fd, self._HEADER.size)
+            if existing and existing != header:
+                raise ValueError('Shared cache file was created with '
+                                 'different parameters')
+
+            if not existing:
+                os.ftruncate(self._fd, size)
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                os.write(self._fd, header)
+
+        return mmap.mmap(self._fd, size)
+
+    def _digest(self, key):
+        data = pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def _slot_offset(self, index):
+        return self._HEADER.size + index * self._slot_size
+
+    def _window(self, digest):
+        bucket = int.from_bytes(digest[:8], 'big') % self._capacity
+        return [self._slot_offset((bucket + i) % self._capacity)
+                for i in range(self._WINDOW)]
+
+    def _read(self, offset):
+        """Reads a slot with the seqlock protocol, returning a tuple of the
+        digest, expiration time and encoded value, or None if the slot is
+        being written"""
+        for attempt in range(self._READ_ATTEMPTS):
+            sequence, referenced, digest, expires, length = \
+                self._SLOT.unpack_from(self._map, offset)
+            if sequence & 1:
+                continue
+
+            start = offset + self._SLOT.size
+            value = self._map[start:start + length]
+            if self._SEQUENCE.unpack_from(self._map, offset)[0] == sequence:
+                return digest, expires, value
+
+        return None
+
+    def _write(self, digest, expires, data):
+        now = time.time()
+        with _FileLock(self._fd):
+            window = self._window(digest)
+            target = None
+            for offset in window:
+                slot_digest, slot_expires = self._SLOT.unpack_from(
+                    self._map, offset)[2:4]
+                if slot_digest == digest:
+                    target = offset
+                    break
+                if target is None and slot_expires <= now:
+                    target = offset
+
+            if data is None:
+                # Deleting, only the slot holding the key is written
+                if target is None or self._map[target + 5:target + 21] \
+                        != digest:
+                    return
+                digest = bytes(16)
+                data = b''
+            elif target is None:
+                target = self._evict(window)
+
+            # Make the sequence odd, write the value and the other fields,
+            # and only then publish them by making the sequence even again
+            sequence, = self._SEQUENCE.unpack_from(self._map, target)
+            self._SEQUENCE.pack_into(self._map, target, sequence + 1)
+            start = target + self._SLOT.size
+            self._map[start:start + len(data)] = data
+            self._FIELDS.pack_into(self._map, target + 4, 0, digest, expires,
+                                   len(data))
+            self._SEQUENCE.pack_into(self._map, target, sequence + 2)
+
+    def _evict(self, window):
+        """Clock sweep over the window, returning the offset of the first
+        slot that was not referenced since the last sweep"""
+        self.evictions += 1
+        for offset in window:
+            if not self._map[offset + 4]:
+                return offset
+
+            self._map[offset + 4] = 0
+
+        return window[0]
+
+
+class TieredCache(object):
+    """Cache combining a per process cache (such as LRUCache) with a
+    SharedCache behind it.
+
+    Lookups check the per process cache first, then the shared cache
+    (copying any hit into the per process cache until it expires). Entries
+    are written to both caches.
+    """
+
+    def __init__(self, local, shared):
+        """Initializes the tiered cache.
+
+        Args:
+            local: Per process cache with the LRUCache interface.
+            shared: SharedCache object.
+        """
+        self._local = local
+        self._shared = shared
+
+    @property
+    def local(self):
+        """Returns the per process cache"""
+        return self._local
+
+    @property
+    def shared(self):
+        """Returns the shared cache"""
+        return self._shared
+
+    def __len__(self):
+        return len(self._local)
+
+    def get(self, key, default=MISSING):
+        value = self._local.get(key, MISSING)
+        if value is not MISSING:
+            return value
+
+        entry = self._shared.get_entry(key)
+        if entry is None:
+            return default
+
+        value, expires = entry
+        self._local.set(key, value, expires - time.time())
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._local.set(key, value, ttl)
+        if ttl is not None:
+            self._shared.set(key, value, ttl)
+
+    def pop(self, key, default=None):
+        self._shared.pop(key)
+        return self._local.pop(key, default)
+
+    def clear(self):
+        self._local.clear()
+        self._shared.clear()
+
+
+def open_shared_cache(path, capacity=65536, value_size=128):
+    """Opens a SharedCache, returning None (after logging a warning) if
+    shared memory is not available, so callers fall back to per process
+    caching.
+
+    Args:
+        path: Path of the memory mapped file.
+        capacity: Number of slots in the table.
+        value_size: Maximum size in bytes of an encoded value.
+    """
+    try:
+        return SharedCache(path, capacity, value_size)
+    except (OSError, ValueError) as e:
+        logger.warning('Shared cache %s unavailable, using per process '
+                       'caching only: %s', path, e)
+        return None
+
+
+def _open_private(path):
+    """Opens (creating it if required) a file which must be a regular file
+    owned by the current user with 0600 permissions, so that other local
+    users cannot have planted or tampered with it. Returns the descriptor."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0),
+                 0o600)
+    try:
+        st = os.fstat(fd)
+        if (not stat.S_ISREG(st.st_mode) or
+            stat.S_IMODE(st.st_mode) != 0o600 or
+            (hasattr(os, 'geteuid') and st.st_uid != os.geteuid())):
+            raise PermissionError(
+                '{} must be a regular file owned by the current user with '
+                '0600 permissions'.format(path))
+    except BaseException:
+        os.close(fd)
+        raise
+
+    return fd
+
+
+def _encode(value):
+    """Encodes a value as JSON, raising TypeError if it cannot be stored"""
+    return json.dumps(_to_json(value), separators=(',', ':')).encode('utf-8')
+
+
+def _decode(data):
+    return _from_json(json.loads(bytes(data).decode('utf-8')))
+
+
+def _to_json(value):
+    # Exact types, so subclasses (such as IntEnum members) are not stored
+    # and read back as a different type
+    if value is None or type(value) in (bool, int, float, str):
+        return value
+    if type(value) in (tuple, list):
+        return [_to_json(item) for item in value]
+    if type(value) is Group:
+        return {'group': value.name}
+
+    raise TypeError('Cannot store {} values in a shared cache'.format(
+        type(value).__name__))
+
+
+def _from_json(value):
+    if isinstance(value, list):
+        return tuple(_from_json(item) for item in value)
+    if isinstance(value, dict):
+        return Group[value['group']]
+
+    return value
+
+
+class _FileLock(object):
+    """Exclusive advisory lock on a file, held across processes"""
+
+    def __init__(self, fd):
+        self._fd = fd
+
+    def __enter__(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
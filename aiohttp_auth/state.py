@@ -0,0 +1,66 @@
+from collections import namedtuple
+
+
+"""Key used to store the AuthState in the request object"""
+STATE_KEY = 'aiohttp_auth.state'
+
+"""Identity or groups of a request which have not been resolved yet, since
+None is a valid resolved value"""
+UNRESOLVED = object()
+
+"""Settings of an auth_middleware, shared by every request it handles"""
+AuthSettings = namedtuple('AuthSettings', 'policy observer rate_limiter')
+
+"""Settings of an acl_middleware, shared by every request it handles"""
+ACLSettings = namedtuple('ACLSettings', 'groups_callback observer')
+
+
+class AuthState(object):
+    """Per request state of the aiohttp_auth middlewares and policies.
+
+    A single AuthState object is stored in the request (under STATE_KEY) by
+    the first middleware that handles it, rather than storing each value
+    under its own key. The settings of the middlewares are shared between
+    requests, so the state only holds a reference to them.
+
+    Only the values used by every request are held in the state. Values used
+    by optional features (the ticket id of StoreTktAuthentication, the group
+    mask of get_user_group_mask() and the contexts of context factories) are
+    stored under their own request keys by those features, so requests not
+    using them do not pay for them.
+
+    Attributes:
+        auth: AuthSettings of the auth_middleware handling the request, or
+            None.
+        acl: ACLSettings of the acl_middleware handling the request, or None.
+        identity: user_id resolved for the request (None if unauthenticated),
+            or UNRESOLVED.
+        cookie: Pending cookie action of the cookie ticket policies, the
+            ticket to set, '' to delete the cookie, or None.
+        reissue: Ticket to reissue if the response is successful, or None.
+        groups: Groups resolved for the identity of the request (None if the
+            groups callback denied access), or UNRESOLVED.
+    """
+
+    __slots__ = ('auth', 'acl', 'identity', 'cookie', 'reissue', 'groups')
+
+    def __init__(self):
+        self.auth = None
+        self.acl = None
+        self.identity = UNRESOLVED
+        self.cookie = None
+        self.reissue = None
+        self.groups = UNRESOLVED
+
+
+def get_state(request):
+    """Returns the AuthState of the request, creating it if required.
+
+    Args:
+        request: aiohttp Request object.
+    """
+    state = request.get(STATE_KEY)
+    if state is None:
+        state = request[STATE_KEY] = AuthState()
+
+    return state
@@ -0,0 +1,57 @@
+"""Runs the aiohttp_auth benchmark suite.
+
+Run from the repository root with:
+
+    python -m benchmarks [--filter NAME] [--output results.json]
+                         [--compare baseline.json]
+
+Timings are reported in microseconds per call (seconds per call in the
+comparison and JSON output). Results written with --output
+can be passed to --compare in a later run (for example, on another commit) to
+report the relative change of each benchmark.
+"""
+import argparse
+import json
+from . import runner
+from . import (  # noqa
+    bench_acl,
+    bench_cookie,
+    bench_middleware,
+    bench_ticket)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('--filter', help='only run benchmarks containing this')
+    parser.add_argument('--output', help='write the results to a JSON file')
+    parser.add_argument('--compare', help='JSON results to compare against')
+    parser.add_argument('--label', help='label stored with the results')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiplier for the number of calls timed')
+    args = parser.parse_args(argv)
+
+    results = runner.run(args.filter, args.scale)
+    for name, result in results.items():
+        print('{:<45} {:>14}'.format(name, _format(result)))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(runner.report(results, args.label), f, indent=2)
+
+    if args.compare:
+        print()
+        for name, before, after, ratio in runner.compare(
+                results, runner.load(args.compare)):
+            print('{:<45} {:>14.3f} {:>14.3f} {:>8.2f}x'.format(
+                name, before, after, ratio))
+
+
+def _format(result):
+    if 'value' in result:
+        return '{} {}'.format(result['value'], result['unit'])
+
+    return '{:.3f}us'.format(result['median'] * 1e6)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Benchmarks get_permitted style lookups against plain, compiled and bitmask
+contexts of 10 to 10,000 ACL tuples."""
+from aiohttp_auth.acl.acl import _permitted
+from aiohttp_auth.acl.bitmask import BitmaskACL, BitRegistry
+from aiohttp_auth.acl.compiled import CompiledACL
+from aiohttp_auth.permissions import Permission, Group
+from .runner import register
+
+
+SIZES = (10, 100, 1000, 10000)
+
+GROUPS = frozenset((Group.Everyone, Group.AuthenticatedUser, 'some_user'))
+
+
+def make_context(size):
+    """Returns a context of size ACL tuples, where the permission checked by
+    the benchmark is only granted by the last tuple"""
+    context = [(Permission.Allow, 'group{}'.format(i), ('view', 'edit'))
+               for i in range(size - 1)]
+    context.append((Permission.Allow, Group.Everyone, ('view', 'edit')))
+    return context
+
+
+def _scan(size):
+    def setup():
+        context = make_context(size)
+        return lambda: _permitted(GROUPS, 'edit', context)
+
+    return setup
+
+
+def _compiled(size):
+    def setup():
+        context = CompiledACL(make_context(size))
+        return lambda: context.permits(GROUPS, 'edit')
+
+    return setup
+
+
+def _bitmask(size):
+    def setup():
+        registry = BitRegistry()
+        context = BitmaskACL(make_context(size), registry)
+        mask = registry.group_mask(GROUPS)
+        return lambda: context.permits(mask, 'edit')
+
+    return setup
+
+
+for size in SIZES:
+    number = max(100, 200000 // size)
+    register('acl.permitted.scan[{}]'.format(size), _scan(size), number)
+    register('acl.permitted.compiled[{}]'.format(size), _compiled(size), 20000)
+    register('acl.permitted.bitmask[{}]'.format(size), _bitmask(size), 20000)
@@ -0,0 +1,63 @@
+"""Benchmarks extracting the ticket cookie from realistic multi-kilobyte
+Cookie headers, comparing the targeted scan used by CookieTktAuthentication
+against parsing the whole header."""
+import random
+import string
+from http.cookies import SimpleCookie
+from aiohttp_auth.auth.cookie_ticket_auth import _find_cookie
+from .runner import register
+
+
+TICKET = 'a' * 128 + '5f5e1000some_user!!'
+
+
+def make_header(size, position):
+    """Returns a Cookie header of roughly size bytes of analytics style
+    cookies, with the ticket cookie at position ('first' or 'last')"""
+    rand = random.Random(size)
+    cookies = []
+    length = 0
+    while length < size:
+        name = '_' + ''.join(rand.choice(string.ascii_lowercase)
+                             for i in range(rand.randint(3, 10)))
+        value = ''.join(rand.choice(string.ascii_letters + string.digits)
+                        for i in range(rand.randint(20, 200)))
+        cookies.append('{}={}'.format(name, value))
+        length += len(cookies[-1]) + 2
+
+    ticket = 'AUTH_TKT={}'.format(TICKET)
+    if position == 'first':
+        cookies.insert(0, ticket)
+    else:
+        cookies.append(ticket)
+
+    return '; '.join(cookies)
+
+
+def _parse(size, position):
+    def setup():
+        header = make_header(size, position)
+
+        def parse():
+            cookie = SimpleCookie()
+            cookie.load(header)
+            return cookie['AUTH_TKT'].value
+
+        return parse
+
+    return setup
+
+
+def _find(size, position):
+    def setup():
+        header = make_header(size, position)
+        return lambda: _find_cookie(header, 'AUTH_TKT')
+
+    return setup
+
+
+for size in (1024, 4096, 8192):
+    for position in ('first', 'last'):
+        suffix = '[{}:{}]'.format(size, position)
+        register('cookie.parse' + suffix, _parse(size, position), 500)
+        register('cookie.find' + suffix, _find(size, position), 20000)
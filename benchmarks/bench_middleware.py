@@ -0,0 +1,153 @@
+"""Benchmarks the per request overhead of auth_middleware and acl_middleware
+against a request passed straight to the handler, for middleware factories,
+new style middlewares and the combined auth_acl_middleware."""
+import asyncio
+import gc
+import time
+import tracemalloc
+from ticket_auth import TicketFactory
+from aiohttp_auth import auth, acl, auth_acl_middleware
+from aiohttp_auth.instrumentation import MetricsObserver
+from aiohttp_auth.permissions import Permission, Group
+from .runner import register, register_value
+from aiohttp import web
+from .util import FakeRequest, handler, run_chain
+
+
+SECRET = b'01234567890abcdef'
+
+CONTEXT = [(Permission.Allow, Group.Everyone, ('view',)),
+           (Permission.Allow, 'edit_group', ('view', 'edit')),]
+
+
+async def _groups_callback(user_id):
+    return ('edit_group',) if user_id else ()
+
+
+async def _auth_view(request):
+    await auth.get_auth(request)
+    return web.Response()
+
+
+async def _acl_view(request):
+    await acl.get_permitted(request, 'edit', CONTEXT)
+    return web.Response()
+
+
+def _cookies(policy):
+    ticket = TicketFactory(SECRET).new('some_user',
+                                       valid_until=time.time() + 3600)
+    return {policy.cookie_name: ticket}
+
+
+def _bare():
+    async def bare():
+        return await handler(FakeRequest())
+
+    return bare
+
+
+def _auth(authenticated, observer=None, new_style=False):
+    def setup():
+        policy = auth.CookieTktAuthentication(SECRET, 3600)
+        middlewares = [auth.auth_middleware(policy, observer=observer,
+                                            new_style=new_style)]
+        cookies = _cookies(policy) if authenticated else {}
+
+        async def auth_only():
+            return await run_chain(
+                middlewares, FakeRequest(cookies=cookies), _auth_view)
+
+        return auth_only
+
+    return setup
+
+
+def _acl(authenticated, new_style=False, combined=False):
+    def setup():
+        policy = auth.CookieTktAuthentication(SECRET, 3600)
+        if combined:
+            middlewares = [auth_acl_middleware(policy, _groups_callback,
+                                               new_style=new_style)]
+        else:
+            middlewares = [
+                auth.auth_middleware(policy, new_style=new_style),
+                acl.acl_middleware(_groups_callback, new_style=new_style)]
+        cookies = _cookies(policy) if authenticated else {}
+
+        async def auth_acl():
+            return await run_chain(
+                middlewares, FakeRequest(cookies=cookies), _acl_view)
+
+        return auth_acl
+
+    return setup
+
+
+def _request_bytes(observed, number=1000):
+    """Returns the memory held by aiohttp_auth per request, once the request
+    has been through auth_middleware and acl_middleware. If observed, an
+    observer and rate limiter are configured too, which is the case where the
+    AuthState uses less memory than separate request keys"""
+    policy = auth.CookieTktAuthentication(SECRET, 3600)
+    if observed:
+        observer = MetricsObserver()
+        middlewares = [
+            auth.auth_middleware(policy, observer=observer,
+                                 rate_limiter=auth.RateLimiter()),
+            acl.acl_middleware(_groups_callback, observer=observer)]
+    else:
+        middlewares = [auth.auth_middleware(policy),
+                       acl.acl_middleware(_groups_callback)]
+    cookies = _cookies(policy)
+    loop = asyncio.new_event_loop()
+
+    def measure(chain):
+        # Warm up, so caches and metrics filled once are not counted
+        for i in range(100):
+            loop.run_until_complete(chain(FakeRequest(cookies=cookies)))
+
+        requests = [None] * number
+        gc.collect()
+        tracemalloc.start()
+        try:
+            start = tracemalloc.get_traced_memory()[0]
+            for i in range(number):
+                request = FakeRequest(cookies=cookies)
+                loop.run_until_complete(chain(request))
+                requests[i] = request
+            # Only count the memory retained by the requests
+            gc.collect()
+            return tracemalloc.get_traced_memory()[0] - start
+        finally:
+            tracemalloc.stop()
+
+    try:
+        bare = measure(handler)
+        full = measure(lambda request: run_chain(middlewares, request,
+                                                 _acl_view))
+    finally:
+        loop.close()
+
+    return round((full - bare) / number)
+
+
+register('middleware.bare', _bare, 20000)
+register('middleware.auth.anonymous', _auth(False), 10000)
+register('middleware.auth.authenticated', _auth(True), 10000)
+register('middleware.auth.authenticated.observed',
+         _auth(True, MetricsObserver()), 10000)
+register('middleware.auth_acl.anonymous', _acl(False), 10000)
+register('middleware.auth_acl.authenticated', _acl(True), 10000)
+register('middleware.new_style.auth.authenticated',
+         _auth(True, new_style=True), 10000)
+register('middleware.new_style.auth_acl.authenticated',
+         _acl(True, new_style=True), 10000)
+register('middleware.combined.authenticated',
+         _acl(True, combined=True), 10000)
+register('middleware.combined.new_style.authenticated',
+         _acl(True, new_style=True, combined=True), 10000)
+register_value('middleware.auth_acl.request_bytes',
+               lambda: _request_bytes(False), 'bytes')
+register_value('middleware.auth_acl.observed.request_bytes',
+               lambda: _request_bytes(True), 'bytes')
@@ -0,0 +1,84 @@
+"""Benchmarks CookieTktAuthentication.get with valid, expired and invalid
+tickets, with and without the validated ticket cache, and the reissue path,
+for both the hex and compact ticket formats."""
+import time
+from ticket_auth import TicketFactory
+from aiohttp_auth.auth import CookieTktAuthentication
+from aiohttp_auth.auth.compact_ticket import CompactTicketFactory
+from .runner import register, register_value
+from .util import FakeRequest, handler
+
+
+SECRET = b'01234567890abcdef'
+
+
+def _get(ticket, **kwargs):
+    def setup():
+        policy = CookieTktAuthentication(SECRET, 60, **kwargs)
+        cookies = {} if ticket is None else {policy.cookie_name: ticket()}
+
+        async def get():
+            return await policy.get(FakeRequest(cookies=cookies))
+
+        return get
+
+    return setup
+
+
+def _reissue():
+    policy = CookieTktAuthentication(SECRET, 60, 0, cache_size=0)
+    ticket = TicketFactory(SECRET).new('some_user',
+                                       valid_until=time.time() + 60)
+    cookies = {policy.cookie_name: ticket}
+
+    async def reissue():
+        request = FakeRequest(cookies=cookies)
+        await policy.get(request)
+        await policy.process_response(request, await handler(request))
+
+    return reissue
+
+
+def _valid():
+    return TicketFactory(SECRET).new('some_user',
+                                     valid_until=time.time() + 3600)
+
+
+def _expired():
+    return TicketFactory(SECRET).new('some_user', valid_until=time.time() - 1)
+
+
+def _invalid():
+    return TicketFactory(b'fedcba09876543210').new(
+        'some_user', valid_until=time.time() + 3600)
+
+
+def _compact_valid():
+    return CompactTicketFactory(SECRET).new(
+        'some_user', valid_until=time.time() + 3600)
+
+
+def _compact_invalid():
+    return CompactTicketFactory(b'fedcba09876543210').new(
+        'some_user', valid_until=time.time() + 3600)
+
+
+def _header_size(ticket):
+    return lambda: len('AUTH_TKT={}'.format(ticket()))
+
+
+register('ticket.get.no_ticket', _get(None), 20000)
+register('ticket.get.valid', _get(_valid, cache_size=0), 5000)
+register('ticket.get.valid.cached', _get(_valid), 20000)
+register('ticket.get.expired', _get(_expired, cache_size=0), 5000)
+register('ticket.get.invalid', _get(_invalid, cache_size=0), 5000)
+register('ticket.get.reissue', _reissue, 2000)
+register('ticket.get.compact.valid',
+         _get(_compact_valid, cache_size=0, ticket_format='compact'), 5000)
+register('ticket.get.compact.invalid',
+         _get(_compact_invalid, cache_size=0, ticket_format='compact'), 5000)
+register('ticket.get.compact.migrate',
+         _get(_valid, cache_size=0, ticket_format='compact'), 5000)
+register_value('ticket.header_size', _header_size(_valid), 'bytes')
+register_value('ticket.compact.header_size', _header_size(_compact_valid),
+               'bytes')
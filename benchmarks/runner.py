@@ -0,0 +1,144 @@
+"""Minimal benchmark registry and runner.
+
+Benchmarks are registered with a name and a setup function. The setup
+function is called once and returns the callable to time, which can be either
+a normal function or a coroutine function. Results are reported as seconds
+per call, and can be written to (and compared against) a JSON file.
+
+Values that are measured rather than timed (such as the size of a ticket) can
+be registered with register_value(), and are reported alongside the timings.
+"""
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import time
+
+
+_BENCHMARKS = []
+
+_VALUES = []
+
+
+def register(name, setup, number=1000, repeat=5):
+    """Registers a benchmark.
+
+    Args:
+        name: Unique name of the benchmark, used to compare results.
+        setup: Function returning the function or coroutine function to time.
+        number: Number of calls timed in each repeat.
+        repeat: Number of times the calls are timed.
+    """
+    _BENCHMARKS.append((name, setup, number, repeat))
+
+
+def register_value(name, func, unit):
+    """Registers a measured value.
+
+    Args:
+        name: Unique name of the value, used to compare results.
+        func: Function returning the value.
+        unit: Name of the unit of the value (for example 'bytes').
+    """
+    _VALUES.append((name, func, unit))
+
+
+def benchmark(name, number=1000, repeat=5):
+    """Decorator form of register()"""
+    def decorator(setup):
+        register(name, setup, number, repeat)
+        return setup
+
+    return decorator
+
+
+def _time_sync(func, number):
+    start = time.perf_counter()
+    for i in range(number):
+        func()
+    return time.perf_counter() - start
+
+
+async def _time_async(func, number):
+    start = time.perf_counter()
+    for i in range(number):
+        await func()
+    return time.perf_counter() - start
+
+
+def run(name_filter=None, scale=1.0, loop=None):
+    """Runs the registered benchmarks.
+
+    Args:
+        name_filter: Optional substring, only benchmarks with names containing
+            it are run.
+        scale: Multiplier applied to the number of calls of each benchmark.
+        loop: Event loop used to run coroutine benchmarks.
+
+    Returns:
+        A dict mapping benchmark names to their results.
+    """
+    if loop is None:
+        loop = asyncio.new_event_loop()
+
+    results = {}
+    for name, setup, number, repeat in _BENCHMARKS:
+        if name_filter and name_filter not in name:
+            continue
+
+        number = max(1, int(number * scale))
+        func = setup()
+        timings = []
+        for i in range(repeat):
+            if asyncio.iscoroutinefunction(func):
+                elapsed = loop.run_until_complete(_time_async(func, number))
+            else:
+                elapsed = _time_sync(func, number)
+            timings.append(elapsed / number)
+
+        results[name] = {
+            'min': min(timings),
+            'median': statistics.median(timings),
+            'mean': statistics.mean(timings),
+            'number': number,
+            'repeat': repeat,
+        }
+
+    for name, func, unit in _VALUES:
+        if name_filter and name_filter not in name:
+            continue
+
+        results[name] = {'value': func(), 'unit': unit}
+
+    return results
+
+
+def report(results, label=None):
+    """Returns the results as a JSON serializable document"""
+    return {
+        'label': label,
+        'timestamp': int(time.time()),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def compare(results, baseline):
+    """Yields (name, baseline, current, ratio) for every benchmark present
+    in both results, using the median timings for timed benchmarks"""
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+
+        field = 'value' if 'value' in current else 'median'
+        ratio = current[field] / previous[field]
+        yield name, previous[field], current[field], ratio
+
+
+def load(path):
+    """Loads the results from a JSON file written by the runner"""
+    with open(path) as f:
+        return json.load(f)['results']
@@ -0,0 +1,53 @@
+"""Lightweight stand-ins for the aiohttp objects used by the benchmarks.
+
+The benchmarks measure the overhead added by aiohttp_auth, so requests are
+plain mappings carrying only the attributes the middlewares and policies
+read, and middleware chains are built per request the same way the aiohttp
+application builds them for middleware factories and new style middlewares.
+"""
+from functools import partial
+from aiohttp import web
+
+
+class FakeTransport(object):
+
+    def __init__(self, peername):
+        self._peername = peername
+
+    def get_extra_info(self, name, default=None):
+        if name == 'peername':
+            return self._peername
+
+        return default
+
+
+class FakeRequest(dict):
+
+    def __init__(self, path='/', cookies=None, headers=None,
+                 peer='127.0.0.1'):
+        super().__init__()
+        self.path = path
+        self.cookies = cookies or {}
+        self.headers = headers or {}
+        if cookies and 'Cookie' not in self.headers:
+            self.headers['Cookie'] = '; '.join(
+                '{}={}'.format(k, v) for k, v in cookies.items())
+        self.match_info = None
+        self.transport = FakeTransport((peer, 12345))
+
+
+async def handler(request):
+    return web.Response()
+
+
+async def run_chain(middlewares, request, view=handler, app=None):
+    """Passes the request through the middlewares and view. New style
+    middlewares are wrapped with a partial per request, as aiohttp does."""
+    chain = view
+    for middleware in reversed(middlewares):
+        if getattr(middleware, '__middleware_version__', None) == 1:
+            chain = partial(middleware, handler=chain)
+        else:
+            chain = await middleware(app, chain)
+
+    return await chain(request)
@@ -1,9 +1,14 @@
 import unittest
 import json
+import os
+import tempfile
+from asyncio import CancelledError, Event, ensure_future, gather, sleep
 from aiohttp import web
-from aiohttp_auth import auth, auth_middleware
+from aiohttp_auth import auth, auth_middleware, auth_acl_middleware
 from aiohttp_auth import acl, acl_middleware
 from aiohttp_auth.permissions import Group, Permission
+from aiohttp_auth.instrumentation import MetricsObserver
+from aiohttp_auth.shared_cache import SharedCache
 from aiohttp_session import session_middleware, SimpleCookieStorage
 from .util import asyncio
 from .util.aiohttp.test import (
@@ -70,6 +75,40 @@ class ACLMiddlewareTests(unittest.TestCase):
         groups = await acl.get_user_groups(request)
         self.assertIsNone(groups)
 
+    @asyncio.run_until_complete()
+    async def test_groups_cached_in_request(self):
+        calls = []
+
+        async def groups_callback(user_id):
+            calls.append(user_id)
+            return ('group0',)
+
+        request = await make_request('GET', '/', \
+            self._middleware(groups_callback))
+
+        context = [(Permission.Allow, 'group0', ('test0', 'test1')),]
+        self.assertTrue(await acl.get_permitted(request, 'test0', context))
+        self.assertTrue(await acl.get_permitted(request, 'test1', context))
+        self.assertEqual(calls, [None])
+
+        acl.invalidate_user_groups(request)
+        groups = await acl.get_user_groups(request)
+        self.assertIn('group0', groups)
+        self.assertEqual(calls, [None, None])
+
+    @asyncio.run_until_complete()
+    async def test_groups_recalculated_after_remember(self):
+        request = await make_request('GET', '/', \
+            self._middleware(self._groups_callback))
+
+        groups = await acl.get_user_groups(request)
+        self.assertNotIn('some_user', groups)
+
+        await auth.remember(request, 'some_user')
+        groups = await acl.get_user_groups(request)
+        self.assertIn('some_user', groups)
+        self.assertIn(Group.AuthenticatedUser, groups)
+
     @asyncio.run_until_complete()
     async def test_acl_permissions(self):
         request = await make_request('GET', '/', \
@@ -82,6 +121,31 @@ class ACLMiddlewareTests(unittest.TestCase):
         self.assertTrue(await acl.get_permitted(request, 'test0', context))
         self.assertFalse(await acl.get_permitted(request, 'test1', context))
 
+    @asyncio.run_until_complete()
+    async def test_acl_permissions_many(self):
+        request = await make_request('GET', '/', \
+            self._middleware(self._groups_callback))
+
+        context = [(Permission.Allow, 'group0', ('test0',)),
+                   (Permission.Deny, 'group1', ('test1',)),
+                   (Permission.Allow, Group.Everyone, ('test1', 'test2')),]
+
+        permissions = ('test0', 'test1', 'test2', 'test3')
+        expected = {'test0', 'test2'}
+        self.assertEqual(await acl.get_permitted_many(
+            request, permissions, context), expected)
+        self.assertEqual(await acl.get_permitted_many(
+            request, permissions, acl.CompiledACL(context)), expected)
+
+    @asyncio.run_until_complete()
+    async def test_acl_permissions_many_forbidden_user(self):
+        request = await make_request('GET', '/', \
+            self._middleware(self._none_groups_callback))
+
+        context = [(Permission.Allow, Group.Everyone, ('test0',)),]
+        self.assertEqual(await acl.get_permitted_many(
+            request, ('test0',), context), set())
+
     @asyncio.run_until_complete()
     async def test_permission_order(self):
         session_data = make_auth_session(
@@ -104,6 +168,566 @@ class ACLMiddlewareTests(unittest.TestCase):
         self.assertFalse(await acl.get_permitted(request0, 'test1', context))
         self.assertTrue(await acl.get_permitted(request1, 'test1', context))
 
+    @asyncio.run_until_complete()
+    async def test_compiled_acl_permissions(self):
+        request = await make_request('GET', '/', \
+            self._middleware(self._groups_callback))
+
+        context = acl.CompiledACL([
+            (Permission.Allow, 'group0', ('test0',)),
+            (Permission.Deny, 'group1', ('test1',)),
+            (Permission.Allow, Group.Everyone, ('test1',)),])
+
+        self.assertTrue(await acl.get_permitted(request, 'test0', context))
+        self.assertFalse(await acl.get_permitted(request, 'test1', context))
+        self.assertFalse(await acl.get_permitted(request, 'test2', context))
+
+    @asyncio.run_until_complete()
+    async def test_compiled_acl_permission_order(self):
+        session_data = make_auth_session(
+            self.SECRET, 'some_user', self.auth.cookie_name)
+
+        request0 = await make_request('GET', '/', \
+            self._middleware(self._auth_groups_callback), \
+            [(self.storage.cookie_name, json.dumps(session_data))])
+
+        request1 = await make_request('GET', '/', \
+            self._middleware(self._auth_groups_callback))
+
+        context = acl.CompiledACL([
+            (Permission.Allow, Group.Everyone, ('test0',)),
+            (Permission.Deny, 'group1', ('test1',)),
+            (Permission.Allow, Group.Everyone, ('test1',)),
+            (Permission.Allow, 'group1', ('test1',)),])
+
+        self.assertTrue(await acl.get_permitted(request0, 'test0', context))
+        self.assertTrue(await acl.get_permitted(request1, 'test0', context))
+
+        self.assertFalse(await acl.get_permitted(request0, 'test1', context))
+        self.assertTrue(await acl.get_permitted(request1, 'test1', context))
+
+    @asyncio.run_until_complete()
+    async def test_bitmask_acl_permissions(self):
+        session_data = make_auth_session(
+            self.SECRET, 'some_user', self.auth.cookie_name)
+
+        request0 = await make_request('GET', '/', \
+            self._middleware(self._auth_groups_callback), \
+            [(self.storage.cookie_name, json.dumps(session_data))])
+
+        request1 = await make_request('GET', '/', \
+            self._middleware(self._auth_groups_callback))
+
+        context = acl.BitmaskACL([
+            (Permission.Allow, Group.Everyone, ('test0',)),
+            (Permission.Deny, 'group1', ('test1',)),
+            (Permission.Allow, Group.Everyone, ('test1',)),
+            (Permission.Allow, 'group1', ('test1',)),], acl.BitRegistry())
+
+        self.assertTrue(await acl.get_permitted(request0, 'test0', context))
+        self.assertTrue(await acl.get_permitted(request1, 'test0', context))
+
+        self.assertFalse(await acl.get_permitted(request0, 'test1', context))
+        self.assertTrue(await acl.get_permitted(request1, 'test1', context))
+        self.assertFalse(await acl.get_permitted(request1, 'test2', context))
+
+        self.assertEqual(await acl.get_permitted_many(
+            request0, ('test0', 'test1'), context), {'test0'})
+
+    def test_bitmask_registry(self):
+        registry = acl.BitRegistry()
+        self.assertEqual(registry.group_mask((Group.Everyone,)), 1)
+        self.assertEqual(registry.group_mask(('unknown',)), 0)
+
+        bit = registry.group_bit('group0')
+        self.assertEqual(registry.group_bit('group0'), bit)
+        self.assertEqual(registry.group_mask(('group0', Group.Everyone)),
+                         bit | 1)
+
+    def test_compiled_acl_matches_context(self):
+        context = [(Permission.Allow, 'group0', ('test0', 'test1')),
+                   (Permission.Deny, 'group1', ('test1',)),
+                   (Permission.Allow, 'group1', ('test0', 'test1')),]
+
+        compiled = acl.CompiledACL(context)
+        self.assertEqual(list(compiled), context)
+        self.assertEqual(len(compiled), 3)
+
+        with self.assertRaises(AttributeError):
+            compiled._entries = ()
+
+    def test_compiled_acl_rejects_malformed_entries(self):
+        with self.assertRaises(TypeError):
+            acl.CompiledACL([(Permission.Allow, 'group0')])
+
+        with self.assertRaises(TypeError):
+            acl.CompiledACL([(True, 'group0', ('test0',))])
+
+        with self.assertRaises(TypeError):
+            acl.CompiledACL([(Permission.Allow, 'group0', ('test0'))])
+
+    @asyncio.run_until_complete()
+    async def test_resource_permissions(self):
+        request = await make_request('GET', '/', \
+            self._middleware(self._groups_callback))
+
+        org = acl.Resource([(Permission.Allow, 'group0', ('view', 'edit'))])
+        project = acl.Resource([(Permission.Deny, 'group1', ('edit',))], org)
+        document = acl.Resource((), project)
+
+        self.assertTrue(await acl.get_permitted(request, 'view', document))
+        self.assertFalse(await acl.get_permitted(request, 'edit', document))
+        self.assertTrue(await acl.get_permitted(request, 'edit', org))
+        self.assertEqual(await acl.get_permitted_many(
+            request, ('view', 'edit', 'delete'), document), {'view'})
+
+    def test_resource_compiled_acl_invalidation(self):
+        org = acl.Resource([(Permission.Allow, 'group0', ('view',))])
+        project = acl.Resource((), org)
+        document = acl.Resource([(Permission.Deny, 'group0', ('view',))],
+                                project)
+
+        compiled = document.compiled_acl()
+        self.assertIs(document.compiled_acl(), compiled)
+        self.assertEqual(len(compiled), 2)
+        self.assertFalse(compiled.permits({'group0'}, 'view'))
+
+        # Changes to an ancestor are pushed down to the descendants
+        version = document.version
+        org.acl = [(Permission.Allow, 'group1', ('view',))]
+        self.assertGreater(document.version, version)
+        self.assertTrue(document.compiled_acl().permits({'group1'}, 'view'))
+
+        document.parent = None
+        self.assertEqual(len(document.compiled_acl()), 1)
+        self.assertEqual(list(project.lineage()), [project, org])
+
+        with self.assertRaises(ValueError):
+            org.parent = project
+
+        with self.assertRaises(TypeError):
+            acl.Resource([(Permission.Allow, 'group0', 'view')])
+
+    @asyncio.run_until_complete()
+    async def test_acl_required_callable_context(self):
+        request = await make_request('GET', '/', \
+            self._middleware(self._groups_callback))
+
+        def context():
+            return [(Permission.Allow, 'group0', ('test0',))]
+
+        @acl.acl_required('test0', context)
+        async def allowed_view(request):
+            return web.Response()
+
+        @acl.acl_required('test1', context)
+        async def forbidden_view(request):
+            return web.Response()
+
+        for i in range(2):
+            response = await allowed_view(request)
+            self.assertEqual(response.status, 200)
+
+        with self.assertRaises(web.HTTPForbidden):
+            await forbidden_view(request)
+
+    @asyncio.run_until_complete()
+    async def test_compile_route_acls(self):
+        context = [(Permission.Allow, 'group0', ('test0',)),
+                   (Permission.Deny, 'group1', ('test1',))]
+
+        @acl.acl_required('test0', context)
+        @auth.auth_required
+        async def view(request):
+            return web.Response()
+
+        async def public_view(request):
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_route('GET', '/view', view, name='view')
+        app.router.add_route('GET', '/public', public_view)
+
+        table = acl.compile_route_acls(app)
+        self.assertIs(app[acl.routes.ROUTE_PERMISSIONS_KEY], table)
+        self.assertEqual([(r.path, r.name, r.auth_required) for r in table],
+                         [('/view', 'view', True), ('/public', None, False)])
+
+        permission, compiled = table[0].permissions[0]
+        self.assertEqual(permission, 'test0')
+        self.assertIsInstance(compiled, acl.CompiledACL)
+        self.assertEqual(list(compiled), context)
+
+        # The decorator uses the compiled context
+        self.assertIs(view._acl_requirements[0].resolve(), compiled)
+
+    def test_compile_route_acls_rejects_malformed_context(self):
+        @acl.acl_required('test0', [(Permission.Allow, 'group0', 'test0')])
+        async def view(request):
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_route('GET', '/view', view)
+
+        with self.assertRaises(TypeError):
+            acl.compile_route_acls(app)
+
+    @asyncio.run_until_complete()
+    async def test_context_factory_cached_by_key(self):
+        loads = []
+
+        @acl.context_factory(key='document_id', maxsize=2)
+        async def document_context(request):
+            loads.append(request.match_info['document_id'])
+            return [(Permission.Allow, 'group0', ('view',)),
+                    (Permission.Deny, 'group1', ('edit',))]
+
+        @acl.acl_required('view', document_context)
+        @acl.acl_required('edit', document_context)
+        async def edit_view(request):
+            return web.Response()
+
+        @acl.acl_required('view', document_context)
+        async def view(request):
+            return web.Response()
+
+        for document_id in ('doc0', 'doc0', 'doc1'):
+            request = await make_request('GET', '/', \
+                self._middleware(self._groups_callback), \
+                match_info={'document_id': document_id})
+
+            response = await view(request)
+            self.assertEqual(response.status, 200)
+            with self.assertRaises(web.HTTPForbidden):
+                await edit_view(request)
+
+        self.assertEqual(loads, ['doc0', 'doc1'])
+        self.assertIsInstance(document_context.cache.get('doc0'),
+                              acl.CompiledACL)
+
+        document_context.invalidate('doc0')
+        request = await make_request('GET', '/', \
+            self._middleware(self._groups_callback), \
+            match_info={'document_id': 'doc0'})
+        self.assertTrue(await acl.get_permitted(
+            request, 'view', document_context))
+        self.assertEqual(loads, ['doc0', 'doc1', 'doc0'])
+
+    @asyncio.run_until_complete()
+    async def test_context_factory_cancelled_load(self):
+        loads = []
+
+        @acl.context_factory(key='document_id')
+        async def document_context(request):
+            loads.append(request.match_info['document_id'])
+            await sleep(0.01)
+            return [(Permission.Allow, 'group0', ('view',))]
+
+        requests = [await make_request('GET', '/', \
+                        self._middleware(self._groups_callback), \
+                        match_info={'document_id': 'doc0'})
+                    for i in range(3)]
+
+        # Cancelling one of two concurrent requests does not fail the other
+        first = ensure_future(document_context(requests[0]))
+        second = ensure_future(document_context(requests[1]))
+        await sleep(0)
+        first.cancel()
+        self.assertIsInstance(await second, acl.CompiledACL)
+        with self.assertRaises(CancelledError):
+            await first
+        self.assertEqual(loads, ['doc0'])
+
+        # Cancelling the only waiter of a load does not fail the next request
+        document_context.invalidate('doc0')
+        first = ensure_future(document_context(requests[0]))
+        await sleep(0)
+        first.cancel()
+        await sleep(0)
+        self.assertTrue(await acl.get_permitted(
+            requests[2], 'view', document_context))
+        self.assertEqual(loads, ['doc0', 'doc0', 'doc0'])
+        with self.assertRaises(CancelledError):
+            await first
+
+    @asyncio.run_until_complete()
+    async def test_context_factory_invalidated_during_load(self):
+        loads = []
+        loading = Event()
+        invalidated = Event()
+
+        @acl.context_factory(key='document_id')
+        async def document_context(request):
+            loads.append(request.match_info['document_id'])
+            loading.set()
+            await invalidated.wait()
+            return [(Permission.Allow, 'group0', ('view',))]
+
+        requests = [await make_request('GET', '/', \
+                        self._middleware(self._groups_callback), \
+                        match_info={'document_id': 'doc0'})
+                    for i in range(2)]
+
+        load = ensure_future(document_context(requests[0]))
+        await loading.wait()
+        document_context.invalidate('doc0')
+        invalidated.set()
+
+        # The stale context is used by its request, but not cached
+        self.assertIsInstance(await load, acl.CompiledACL)
+        self.assertNotIn('doc0', document_context.cache)
+        await document_context(requests[1])
+        self.assertEqual(loads, ['doc0', 'doc0'])
+        self.assertIn('doc0', document_context.cache)
+
+    @asyncio.run_until_complete()
+    async def test_context_factory_memoized_per_request(self):
+        loads = []
+
+        async def context(request):
+            loads.append(request)
+            return acl.CompiledACL([(Permission.Allow, 'group0', ('view',))])
+
+        factory = acl.ContextFactory(context)
+        requests = [await make_request('GET', '/', \
+                        self._middleware(self._groups_callback))
+                    for i in range(2)]
+
+        for request in requests:
+            for permission in ('view', 'edit'):
+                await acl.get_permitted(request, permission, factory)
+            self.assertEqual(await acl.get_permitted_many(
+                request, ('view', 'edit'), factory), {'view'})
+
+        self.assertEqual(loads, requests)
+        self.assertIsNone(factory.cache)
+
+    @asyncio.run_until_complete()
+    async def test_combined_middleware(self):
+        session_data = make_auth_session(
+            self.SECRET, 'some_user', self.auth.cookie_name)
+        context = [(Permission.Allow, 'group0', ('test0',)),
+                   (Permission.Allow, Group.AuthenticatedUser, ('test1',))]
+
+        for new_style in (False, True):
+            app = {}
+            cache = acl.GroupsCache()
+            middlewares = [
+                session_middleware(self.storage),
+                auth_acl_middleware(self.auth, self._auth_groups_callback,
+                                    cache=cache, new_style=new_style)]
+
+            request = await make_request('GET', '/', middlewares, \
+                [(self.storage.cookie_name, json.dumps(session_data))], \
+                app=app)
+
+            self.assertEqual(await auth.get_auth(request), 'some_user')
+            self.assertEqual(await acl.get_permitted_many(
+                request, ('test0', 'test1'), context), {'test0', 'test1'})
+
+            # Handling a request does not change the application state
+            self.assertNotIn(acl.acl.GROUPS_CACHE_KEY, app)
+
+    @asyncio.run_until_complete()
+    async def test_new_style_acl_middleware(self):
+        middlewares = [
+            session_middleware(self.storage),
+            auth_middleware(self.auth, new_style=True),
+            acl_middleware(self._groups_callback, new_style=True)]
+
+        request = await make_request('GET', '/', middlewares)
+        groups = await acl.get_user_groups(request)
+        self.assertIn('group0', groups)
+        self.assertIn(Group.Everyone, groups)
+
+    @asyncio.run_until_complete()
+    async def test_groups_cached_across_requests(self):
+        calls = []
+
+        async def groups_callback(user_id):
+            calls.append(user_id)
+            return ('group0',)
+
+        app = {}
+        cache = acl.GroupsCache(maxsize=2, ttl=60)
+        acl.setup_acl(app, cache)
+        middlewares = [
+            session_middleware(self.storage),
+            auth_middleware(self.auth),
+            acl_middleware(groups_callback, cache)]
+
+        for i in range(3):
+            request = await make_request('GET', '/', middlewares, app=app)
+            groups = await acl.get_user_groups(request)
+            self.assertIn('group0', groups)
+
+        self.assertEqual(calls, [None])
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(cache.misses, 1)
+
+        acl.invalidate_groups(app, None)
+        request = await make_request('GET', '/', middlewares, app=app)
+        await acl.get_user_groups(request)
+        self.assertEqual(calls, [None, None])
+
+    @asyncio.run_until_complete()
+    async def test_groups_cache_expiry_and_eviction(self):
+        now = [0]
+        calls = []
+
+        async def groups_callback(user_id):
+            calls.append(user_id)
+            return None if user_id == 'forbidden' else ('group0',)
+
+        cache = acl.GroupsCache(maxsize=2, ttl=10, negative_ttl=5,
+                                clock=lambda: now[0])
+        callback = cache.wrap(groups_callback)
+
+        self.assertIsNone(await callback('forbidden'))
+        self.assertIsNone(await callback('forbidden'))
+        self.assertEqual(calls, ['forbidden'])
+
+        now[0] = 6
+        self.assertIsNone(await callback('forbidden'))
+        self.assertEqual(calls, ['forbidden', 'forbidden'])
+
+        await callback('user0')
+        await callback('user1')
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(len(cache), 2)
+
+        now[0] = 20
+        await callback('user1')
+        self.assertEqual(calls[-1], 'user1')
+
+    @asyncio.run_until_complete()
+    async def test_groups_cache_invalidated_during_load(self):
+        calls = []
+        loading = Event()
+        invalidated = Event()
+
+        async def groups_callback(user_id):
+            calls.append(user_id)
+            loading.set()
+            await invalidated.wait()
+            return ('group0',)
+
+        cache = acl.GroupsCache(ttl=60)
+        callback = cache.wrap(groups_callback)
+
+        load = ensure_future(callback('user0'))
+        await loading.wait()
+        cache.invalidate('user0')
+        invalidated.set()
+
+        # The stale groups are returned to the caller, but not cached
+        self.assertEqual(await load, ('group0',))
+        self.assertNotIn('user0', cache)
+        self.assertEqual(await callback('user0'), ('group0',))
+        self.assertEqual(calls, ['user0', 'user0'])
+        self.assertIn('user0', cache)
+
+    @asyncio.run_until_complete()
+    async def test_groups_cache_shared_between_processes(self):
+        calls = []
+
+        async def groups_callback(user_id):
+            calls.append(user_id)
+            return ('group0',)
+
+        with tempfile.TemporaryDirectory() as directory:
+            shared = SharedCache(os.path.join(directory, 'groups'), 64)
+            caches = [acl.GroupsCache(ttl=60, shared=shared)
+                      for i in range(2)]
+            callbacks = [cache.wrap(groups_callback) for cache in caches]
+
+            for callback in callbacks:
+                self.assertEqual(await callback('user0'), ('group0',))
+            self.assertEqual(calls, ['user0'])
+
+            caches[0].invalidate('user0')
+            caches[1].pop('user0')
+            await callbacks[1]('user0')
+            self.assertEqual(calls, ['user0', 'user0'])
+            shared.close()
+
+    @asyncio.run_until_complete()
+    async def test_concurrent_groups_lookups_coalesced(self):
+        calls = []
+
+        async def groups_callback(user_id):
+            calls.append(user_id)
+            await sleep(0.01)
+            return ('group0',)
+
+        middleware = self._middleware(None) + \
+            [acl_middleware(groups_callback, coalesce=True)]
+
+        requests = [await make_request('GET', '/', middleware)
+                    for i in range(10)]
+        results = await gather(*[acl.get_user_groups(r) for r in requests])
+
+        self.assertEqual(calls, [None])
+        for groups in results:
+            self.assertIn('group0', groups)
+
+    @asyncio.run_until_complete()
+    async def test_single_flight_propagates_exceptions(self):
+        single_flight = acl.SingleFlight()
+
+        async def failing_callback(user_id):
+            await sleep(0.01)
+            raise ValueError(user_id)
+
+        callback = single_flight.wrap(failing_callback)
+        results = await gather(callback('user0'), callback('user0'),
+                               return_exceptions=True)
+
+        self.assertEqual(len(results), 2)
+        for result in results:
+            self.assertIsInstance(result, ValueError)
+        self.assertEqual(len(single_flight), 0)
+
+    @asyncio.run_until_complete()
+    async def test_single_flight_cancelled_call_not_joined(self):
+        single_flight = acl.SingleFlight()
+        calls = []
+
+        async def slow_callback(user_id):
+            calls.append(user_id)
+            await sleep(0.01)
+            return ('group0',)
+
+        callback = single_flight.wrap(slow_callback)
+        first = ensure_future(callback('user0'))
+        await sleep(0)
+        first.cancel()
+        await sleep(0)
+
+        # The shared call is cancelled with its last waiter, and a new caller
+        # starts its own call instead of joining the cancelled one
+        self.assertEqual(len(single_flight), 0)
+        self.assertEqual(await callback('user0'), ('group0',))
+        self.assertEqual(calls, ['user0', 'user0'])
+        with self.assertRaises(CancelledError):
+            await first
+
+    @asyncio.run_until_complete()
+    async def test_observer_outcomes(self):
+        observer = MetricsObserver()
+        middleware = self._middleware(None) + \
+            [acl_middleware(self._groups_callback, observer=observer)]
+
+        request = await make_request('GET', '/', middleware)
+        context = [(Permission.Allow, 'group0', ('test0',)),]
+        self.assertTrue(await acl.get_permitted(request, 'test0', context))
+        self.assertFalse(await acl.get_permitted(request, 'test1', context))
+
+        metrics = observer.snapshot()
+        self.assertEqual(metrics[('acl.groups', 'ok')]['count'], 1)
+        self.assertEqual(metrics[('acl.permitted', 'allowed')]['count'], 1)
+        self.assertEqual(metrics[('acl.permitted', 'denied')]['count'], 1)
+
     async def _groups_callback(self, user_id):
         """Groups callback function that always returns two groups"""
         return ('group0', 'group1')
@@ -1,11 +1,24 @@
 import unittest
 import json
+import os
+import tempfile
 import time
 from os import urandom
+from types import SimpleNamespace
 from aiohttp_auth import auth, auth_middleware
+from aiohttp_auth.auth.compact_ticket import CompactTicketFactory
+from aiohttp_auth.auth.cookie_ticket_auth import _find_cookie, _PARSE
+from aiohttp_auth.instrumentation import MetricsObserver
+from aiohttp_auth.permissions import Group
+from aiohttp_auth.shared_cache import SharedCache, open_shared_cache
+from aiohttp_auth.state import STATE_KEY, UNRESOLVED, AuthState
 from aiohttp_session import session_middleware, SimpleCookieStorage
 from aiohttp import web
-from ticket_auth import TicketFactory
+from ticket_auth import (
+    TicketFactory,
+    TicketParseError,
+    TicketDigestError,
+    TicketExpired)
 from .util import asyncio
 from .util.aiohttp.test import (
     make_request,
@@ -35,6 +48,87 @@ class AuthMiddlewareTests(unittest.TestCase):
         user_id = await auth.get_auth(request)
         self.assertIsNone(user_id)
 
+    @asyncio.run_until_complete()
+    async def test_middleware_caches_unauthenticated_user(self):
+        calls = []
+        auth_ = auth.CookieTktAuthentication(urandom(16), 15)
+        get = auth_.get
+
+        async def counting_get(request):
+            calls.append(request)
+            return await get(request)
+
+        auth_.get = counting_get
+        request = await make_request('GET', '/', [auth_middleware(auth_)])
+        self.assertIsNone(await auth.get_auth(request))
+        self.assertIsNone(await auth.get_auth(request))
+        self.assertEqual(len(calls), 1)
+
+    @asyncio.run_until_complete()
+    async def test_remember_and_forget_update_auth(self):
+        secret = b'01234567890abcdef'
+        auth_ = auth.CookieTktAuthentication(secret, 15, cookie_name='auth')
+        middlewares = [
+            auth_middleware(auth_)]
+
+        session_data = TicketFactory(secret).new('some_user')
+        request = await make_request('GET', '/', middlewares, \
+            [(auth_.cookie_name, session_data)])
+
+        self.assertEqual(await auth.get_auth(request), 'some_user')
+        await auth.forget(request)
+        self.assertIsNone(await auth.get_auth(request))
+        await auth.remember(request, 'other_user')
+        self.assertEqual(await auth.get_auth(request), 'other_user')
+
+    @asyncio.run_until_complete()
+    async def test_middleware_stores_single_state(self):
+        auth_ = auth.CookieTktAuthentication(urandom(16), 15)
+        request = await make_request('GET', '/', [auth_middleware(auth_)])
+
+        state = request[STATE_KEY]
+        self.assertIsInstance(state, AuthState)
+        self.assertFalse(hasattr(state, '__dict__'))
+        self.assertIs(state.auth.policy, auth_)
+        self.assertIs(state.identity, UNRESOLVED)
+        self.assertIsNone(await auth.get_auth(request))
+        self.assertIsNone(state.identity)
+        self.assertEqual(
+            [key for key in request if key.startswith('aiohttp_auth')],
+            [STATE_KEY])
+
+    @asyncio.run_until_complete()
+    async def test_middleware_exempt_prefixes(self):
+        secret = b'01234567890abcdef'
+        auth_ = auth.CookieTktAuthentication(secret, 15, 0, cookie_name='auth')
+        middlewares = [
+            auth_middleware(auth_, exempt_prefixes=('/static/', '/health'))]
+
+        session_data = TicketFactory(secret).new('some_user')
+        for path in ('/static/app.js', '/healthz'):
+            request = await make_request('GET', path, middlewares, \
+                [(auth_.cookie_name, session_data)])
+
+            self.assertIsNone(await auth.get_auth(request))
+            with self.assertRaises(RuntimeError):
+                await auth.remember(request, 'some_user')
+
+            response = await make_response(request, middlewares)
+            self.assertFalse(auth_.cookie_name in response.cookies)
+
+        request = await make_request('GET', '/stat', middlewares, \
+            [(auth_.cookie_name, session_data)])
+        self.assertEqual(await auth.get_auth(request), 'some_user')
+
+    def test_exempt_routes_path_matching(self):
+        exempt = auth.ExemptRoutes(prefixes=('/static/', '/health', '/s'))
+        self.assertTrue(exempt.match_path('/static/css/app.css'))
+        self.assertTrue(exempt.match_path('/health'))
+        self.assertTrue(exempt.match_path('/s'))
+        self.assertFalse(exempt.match_path('/'))
+        self.assertFalse(exempt.match_path('/login'))
+        self.assertFalse(auth.ExemptRoutes())
+
     @asyncio.run_until_complete()
     async def test_middleware_stores_auth_in_session(self):
         secret = b'01234567890abcdef'
@@ -134,3 +228,647 @@ class AuthMiddlewareTests(unittest.TestCase):
 
         response = await make_response(request, middlewares, web.Response(status=400))
         self.assertFalse(auth_.cookie_name in response.cookies)
+
+    @asyncio.run_until_complete()
+    async def test_middleware_caches_validated_ticket(self):
+        secret = b'01234567890abcdef'
+        auth_ = auth.CookieTktAuthentication(secret, 15, 2, cookie_name='auth')
+        middlewares = [
+            auth_middleware(auth_)]
+
+        session_data = TicketFactory(secret).new('some_user')
+        for i in range(2):
+            request = await make_request('GET', '/', middlewares, \
+                [(auth_.cookie_name, session_data)])
+
+            user_id = await auth.get_auth(request)
+            self.assertEqual(user_id, 'some_user')
+
+        self.assertEqual(auth_._cache.hits, 1)
+        self.assertEqual(auth_._cache.misses, 1)
+
+    @asyncio.run_until_complete()
+    async def test_middleware_doesnt_cache_invalid_ticket(self):
+        secret = b'01234567890abcdef'
+        auth_ = auth.CookieTktAuthentication(secret, 15, 2, cookie_name='auth')
+        middlewares = [
+            auth_middleware(auth_)]
+
+        session_data = TicketFactory(b'fedcba09876543210').new('some_user')
+        for i in range(2):
+            request = await make_request('GET', '/', middlewares, \
+                [(auth_.cookie_name, session_data)])
+
+            user_id = await auth.get_auth(request)
+            self.assertIsNone(user_id)
+
+        self.assertEqual(len(auth_._cache), 0)
+
+    @asyncio.run_until_complete()
+    async def test_middleware_reissues_cached_ticket_auth(self):
+        secret = b'01234567890abcdef'
+        auth_ = auth.CookieTktAuthentication(secret, 15, 0, cookie_name='auth')
+        middlewares = [
+            auth_middleware(auth_)]
+
+        valid_until = time.time() + 15
+        session_data = TicketFactory(secret).new('some_user',
+                                                 valid_until=valid_until)
+        for i in range(2):
+            request = await make_request('GET', '/', middlewares, \
+                [(auth_.cookie_name, session_data)])
+
+            user_id = await auth.get_auth(request)
+            self.assertEqual(user_id, 'some_user')
+
+            response = await make_response(request, middlewares)
+            self.assertTrue(auth_.cookie_name in response.cookies)
+
+    @asyncio.run_until_complete()
+    async def test_middleware_observer_outcomes(self):
+        secret = b'01234567890abcdef'
+        observer = MetricsObserver()
+        auth_ = auth.CookieTktAuthentication(secret, 15, cookie_name='auth')
+        middlewares = [
+            auth_middleware(auth_, observer=observer)]
+
+        tickets = (
+            None,
+            TicketFactory(secret).new('some_user'),
+            TicketFactory(secret).new('some_user', valid_until=time.time()),
+            TicketFactory(b'fedcba09876543210').new('some_user'))
+
+        for ticket in tickets:
+            cookies = None if ticket is None else [(auth_.cookie_name, ticket)]
+            request = await make_request('GET', '/', middlewares, cookies)
+            await auth.get_auth(request)
+
+        metrics = observer.snapshot()
+        for outcome in ('no_ticket', 'valid', 'expired', 'bad_signature'):
+            self.assertEqual(metrics[('ticket.validate', outcome)]['count'], 1)
+        self.assertEqual(metrics[('auth.get', 'authenticated')]['count'], 1)
+        self.assertEqual(metrics[('auth.get', 'anonymous')]['count'], 3)
+        self.assertEqual(metrics[('auth.process_response', 'ok')]['count'], 4)
+
+    def test_metrics_observer_quantile(self):
+        observer = MetricsObserver(buckets=(0.001, 0.01, 0.1))
+        for i in range(99):
+            observer.observe('auth.get', 'anonymous', 0.0005)
+        observer.observe('auth.get', 'anonymous', 0.5)
+
+        self.assertEqual(
+            observer.quantile('auth.get', 'anonymous', 0.5), 0.001)
+        self.assertEqual(observer.quantile('auth.get', 'anonymous', 1.0), 0.5)
+        self.assertIsNone(observer.quantile('auth.get', 'authenticated', 0.5))
+
+    @asyncio.run_until_complete()
+    async def test_middleware_keyring_reissues_retired_secret(self):
+        old_secret = b'fedcba09876543210'
+        secret = b'01234567890abcdef'
+        auth_ = auth.CookieTktAuthentication(
+            [secret, old_secret], 15, cookie_name='auth')
+        middlewares = [
+            auth_middleware(auth_)]
+
+        session_data = TicketFactory(old_secret).new('some_user')
+        request = await make_request('GET', '/', middlewares, \
+            [(auth_.cookie_name, session_data)])
+
+        user_id = await auth.get_auth(request)
+        self.assertEqual(user_id, 'some_user')
+
+        response = await make_response(request, middlewares)
+        ticket = response.cookies[auth_.cookie_name].value
+        self.assertEqual(TicketFactory(secret).validate(ticket).user_id,
+                         'some_user')
+
+    @asyncio.run_until_complete()
+    async def test_middleware_keyring_current_secret(self):
+        secret = b'01234567890abcdef'
+        auth_ = auth.CookieTktAuthentication(
+            [secret, b'fedcba09876543210'], 15, cookie_name='auth')
+        middlewares = [
+            auth_middleware(auth_)]
+
+        for secret_ in (secret, b'0000000000000000'):
+            session_data = TicketFactory(secret_).new('some_user')
+            request = await make_request('GET', '/', middlewares, \
+                [(auth_.cookie_name, session_data)])
+
+            user_id = await auth.get_auth(request)
+            response = await make_response(request, middlewares)
+            self.assertFalse(auth_.cookie_name in response.cookies)
+
+        self.assertIsNone(user_id)
+
+    @asyncio.run_until_complete()
+    async def test_middleware_reissue_interval(self):
+        secret = b'01234567890abcdef'
+        auth_ = auth.CookieTktAuthentication(
+            secret, 15, 0, cookie_name='auth', reissue_interval=5)
+        middlewares = [
+            auth_middleware(auth_)]
+
+        session_data = TicketFactory(secret).new('some_user',
+                                                 valid_until=time.time() + 10)
+
+        tickets = []
+        for i in range(2):
+            request = await make_request('GET', '/', middlewares, \
+                [(auth_.cookie_name, session_data)])
+
+            self.assertEqual(await auth.get_auth(request), 'some_user')
+            response = await make_response(request, middlewares)
+            tickets.append(response.cookies[auth_.cookie_name].value)
+
+        self.assertEqual(tickets[0], tickets[1])
+        self.assertNotEqual(tickets[0], session_data)
+
+        # Client now holds the reissued ticket, so no cookie is set
+        request = await make_request('GET', '/', middlewares, \
+            [(auth_.cookie_name, tickets[0])])
+
+        self.assertEqual(await auth.get_auth(request), 'some_user')
+        response = await make_response(request, middlewares)
+        self.assertFalse(auth_.cookie_name in response.cookies)
+
+    def test_reissue_interval_must_be_less_than_ticket_lifetime(self):
+        secret = b'01234567890abcdef'
+        for max_age, reissue_time, interval in (
+                (15, 0, 15), (15, 10, 5), (15, None, 20)):
+            with self.assertRaises(ValueError):
+                auth.CookieTktAuthentication(
+                    secret, max_age, reissue_time,
+                    reissue_interval=interval)
+
+        auth.CookieTktAuthentication(secret, 15, 10, reissue_interval=4)
+        auth.CookieTktAuthentication(secret, 15, None, reissue_interval=14)
+
+    @asyncio.run_until_complete()
+    async def test_store_policy_remember_and_forget(self):
+        secret = b'01234567890abcdef'
+        with tempfile.TemporaryDirectory() as directory:
+            stores = (
+                auth.MemoryTicketStore(),
+                auth.SQLiteTicketStore(os.path.join(directory, 'tickets.db')))
+
+            for store in stores:
+                auth_ = auth.StoreTktAuthentication(
+                    secret, 15, cookie_name='auth', store=store)
+                middlewares = [
+                    auth_middleware(auth_)]
+
+                request = await make_request('GET', '/', middlewares)
+                await auth.remember(request, 'some_user')
+                response = await make_response(request, middlewares)
+                ticket_id = response.cookies[auth_.cookie_name].value
+                self.assertLess(len(ticket_id), 32)
+
+                request = await make_request('GET', '/', middlewares, \
+                    [(auth_.cookie_name, ticket_id)])
+                self.assertEqual(await auth.get_auth(request), 'some_user')
+                await auth.forget(request)
+
+                # The ticket id is no longer valid once forgotten
+                request = await make_request('GET', '/', middlewares, \
+                    [(auth_.cookie_name, ticket_id)])
+                self.assertIsNone(await auth.get_auth(request))
+                await store.close()
+
+    @asyncio.run_until_complete()
+    async def test_store_policy_remember_deletes_previous_ticket(self):
+        secret = b'01234567890abcdef'
+        store = auth.MemoryTicketStore()
+        auth_ = auth.StoreTktAuthentication(
+            secret, 15, cookie_name='auth', store=store)
+        middlewares = [
+            auth_middleware(auth_)]
+
+        request = await make_request('GET', '/', middlewares)
+        await auth.remember(request, 'some_user')
+        response = await make_response(request, middlewares)
+        old_ticket_id = response.cookies[auth_.cookie_name].value
+
+        request = await make_request('GET', '/', middlewares, \
+            [(auth_.cookie_name, old_ticket_id)])
+        await auth.remember(request, 'some_user')
+        response = await make_response(request, middlewares)
+        ticket_id = response.cookies[auth_.cookie_name].value
+        self.assertNotEqual(ticket_id, old_ticket_id)
+
+        # Only the new ticket id authenticates the user
+        for cookie, user_id in ((old_ticket_id, None),
+                                (ticket_id, 'some_user')):
+            request = await make_request('GET', '/', middlewares, \
+                [(auth_.cookie_name, cookie)])
+            self.assertEqual(await auth.get_auth(request), user_id)
+
+    @asyncio.run_until_complete()
+    async def test_forget_drops_pending_reissue(self):
+        secret = b'01234567890abcdef'
+        policies = (
+            auth.CookieTktAuthentication(secret, 15, 0, cookie_name='auth'),
+            auth.StoreTktAuthentication(secret, 15, 0, cookie_name='auth'))
+
+        for auth_ in policies:
+            middlewares = [
+                auth_middleware(auth_)]
+
+            request = await make_request('GET', '/', middlewares)
+            await auth.remember(request, 'some_user')
+            response = await make_response(request, middlewares)
+            cookie = response.cookies[auth_.cookie_name].value
+
+            # get_auth() queues a reissue, which forget() must drop
+            request = await make_request('GET', '/', middlewares, \
+                [(auth_.cookie_name, cookie)])
+            self.assertEqual(await auth.get_auth(request), 'some_user')
+            await auth.forget(request)
+            response = await make_response(request, middlewares)
+            self.assertEqual(response.cookies[auth_.cookie_name].value, '')
+
+        # The stored ticket is gone too, not replaced by a reissued one
+        request = await make_request('GET', '/', middlewares, \
+            [(auth_.cookie_name, cookie)])
+        self.assertIsNone(await auth.get_auth(request))
+
+    def test_find_cookie(self):
+        self.assertEqual(_find_cookie('a=1; auth=abc!def; b=2', 'auth'),
+                         'abc!def')
+        self.assertEqual(_find_cookie('auth=1;auth=2', 'auth'), '2')
+        self.assertEqual(_find_cookie('auth=', 'auth'), '')
+        self.assertIsNone(_find_cookie('a=1; b=2', 'auth'))
+        self.assertIs(_find_cookie('auth="a;b"', 'auth'), _PARSE)
+        self.assertIs(_find_cookie('x=auth=1', 'auth'), _PARSE)
+        self.assertIs(_find_cookie('auth = 1', 'auth'), _PARSE)
+
+    @asyncio.run_until_complete()
+    async def test_middleware_compact_tickets(self):
+        secret = b'01234567890abcdef'
+        auth_ = auth.CookieTktAuthentication(
+            secret, 15, cookie_name='auth', ticket_format='compact')
+        middlewares = [
+            auth_middleware(auth_)]
+
+        request = await make_request('GET', '/', middlewares)
+        await auth.remember(request, 'some_user')
+        response = await make_response(request, middlewares)
+        ticket = response.cookies[auth_.cookie_name].value
+        self.assertLess(len(ticket), 64)
+
+        request = await make_request('GET', '/', middlewares, \
+            [(auth_.cookie_name, ticket)])
+        self.assertEqual(await auth.get_auth(request), 'some_user')
+
+    @asyncio.run_until_complete()
+    async def test_middleware_compact_tickets_migrate_hex_tickets(self):
+        secret = b'01234567890abcdef'
+        auth_ = auth.CookieTktAuthentication(
+            secret, 15, cookie_name='auth', ticket_format='compact')
+        middlewares = [
+            auth_middleware(auth_)]
+
+        session_data = TicketFactory(secret).new('some_user')
+        request = await make_request('GET', '/', middlewares, \
+            [(auth_.cookie_name, session_data)])
+        self.assertEqual(await auth.get_auth(request), 'some_user')
+
+        response = await make_response(request, middlewares)
+        ticket = response.cookies[auth_.cookie_name].value
+        self.assertEqual(
+            CompactTicketFactory(secret).validate(ticket).user_id, 'some_user')
+
+    def test_compact_ticket_factory(self):
+        factory = CompactTicketFactory(b'01234567890abcdef')
+        ticket = factory.new('some_user', client_ip='127.0.0.1')
+        self.assertTrue(ticket.startswith('A'))
+        self.assertEqual(
+            factory.validate(ticket, '127.0.0.1').user_id, 'some_user')
+
+        with self.assertRaises(TicketDigestError):
+            factory.validate(ticket, '127.0.0.2')
+
+        with self.assertRaises(TicketExpired):
+            factory.validate(factory.new('some_user', valid_until=1))
+
+        with self.assertRaises(TicketParseError):
+            factory.validate('not a ticket')
+
+        # Padded, re-encoded or altered copies of the ticket are rejected
+        last = ticket[-1]
+        noncanonical = [ticket + '==', ticket + '=', ' ' + ticket,
+                        ticket[:-1] + '.' + last,
+                        ticket[:10] + '+' + ticket[10:]]
+        for copy in noncanonical:
+            with self.assertRaises(TicketParseError):
+                factory.validate(copy, '127.0.0.1')
+
+    @asyncio.run_until_complete()
+    async def test_middleware_revoked_ticket_rejected(self):
+        secret = b'01234567890abcdef'
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'revoked')
+            policies = [
+                auth.CookieTktAuthentication(
+                    secret, 15, cookie_name='auth',
+                    revocation=auth.RevocationFilter(path, 15, capacity=1000))
+                for i in range(2)]
+
+            session_data = TicketFactory(secret).new('some_user')
+            request = await make_request('GET', '/', \
+                [auth_middleware(policies[0])], \
+                [(policies[0].cookie_name, session_data)])
+            self.assertEqual(await auth.get_auth(request), 'some_user')
+            await auth.forget(request)
+
+            # The ticket is rejected by every policy sharing the filter
+            for policy in policies:
+                request = await make_request('GET', '/', \
+                    [auth_middleware(policy)], \
+                    [(policy.cookie_name, session_data)])
+                self.assertIsNone(await auth.get_auth(request))
+
+    @asyncio.run_until_complete()
+    async def test_middleware_revoked_ticket_replayed_in_other_encoding(self):
+        secret = b'01234567890abcdef'
+
+        # Pick an expiration time whose hex encoding has a letter, so the
+        # ticket can be rewritten with the timestamp in upper case
+        valid_until = int(time.time()) + 10
+        while '{:08x}'.format(valid_until).isdigit():
+            valid_until += 1
+
+        hex_ticket = TicketFactory(secret).new(
+            'some_user', valid_until=valid_until)
+        compact_ticket = CompactTicketFactory(secret).new(
+            'some_user', valid_until=valid_until)
+        cases = [
+            ('hex', hex_ticket,
+             hex_ticket[:128] + hex_ticket[128:136].upper() +
+             hex_ticket[136:]),
+            ('compact', compact_ticket, compact_ticket + '==')]
+
+        for ticket_format, ticket, replayed in cases:
+            self.assertNotEqual(ticket, replayed)
+            with tempfile.TemporaryDirectory() as directory:
+                auth_ = auth.CookieTktAuthentication(
+                    secret, 15, cookie_name='auth',
+                    ticket_format=ticket_format,
+                    revocation=auth.RevocationFilter(
+                        os.path.join(directory, 'revoked'), 15,
+                        capacity=1000))
+                middlewares = [
+                    auth_middleware(auth_)]
+
+                request = await make_request('GET', '/', middlewares, \
+                    [(auth_.cookie_name, ticket)])
+                self.assertEqual(await auth.get_auth(request), 'some_user')
+                await auth.forget(request)
+
+                for copy in (ticket, replayed):
+                    request = await make_request('GET', '/', middlewares, \
+                        [(auth_.cookie_name, copy)])
+                    self.assertIsNone(await auth.get_auth(request))
+
+    @asyncio.run_until_complete()
+    async def test_middleware_revoked_ticket_not_reissued(self):
+        secret = b'01234567890abcdef'
+        with tempfile.TemporaryDirectory() as directory:
+            auth_ = auth.CookieTktAuthentication(
+                secret, 15, 0, cookie_name='auth',
+                revocation=auth.RevocationFilter(
+                    os.path.join(directory, 'revoked'), 15, capacity=1000))
+            middlewares = [
+                auth_middleware(auth_)]
+
+            # get_auth() queues a reissue, which revoking must drop
+            session_data = TicketFactory(secret).new('some_user')
+            request = await make_request('GET', '/', middlewares, \
+                [(auth_.cookie_name, session_data)])
+            self.assertEqual(await auth.get_auth(request), 'some_user')
+            await auth.forget(request)
+            response = await make_response(request, middlewares)
+            self.assertEqual(response.cookies[auth_.cookie_name].value, '')
+
+            request = await make_request('GET', '/', middlewares, \
+                [(auth_.cookie_name, session_data)])
+            self.assertIsNone(await auth.get_auth(request))
+
+    @asyncio.run_until_complete()
+    async def test_middleware_shared_cache_across_policies(self):
+        secret = b'01234567890abcdef'
+        with tempfile.TemporaryDirectory() as directory:
+            shared = SharedCache(os.path.join(directory, 'cache'), 64)
+            policies = [
+                auth.CookieTktAuthentication(
+                    secret, 15, cookie_name='auth', shared_cache=shared)
+                for i in range(2)]
+
+            session_data = TicketFactory(secret).new('some_user')
+            for policy in policies:
+                request = await make_request('GET', '/', \
+                    [auth_middleware(policy)], \
+                    [(policy.cookie_name, session_data)])
+                self.assertEqual(await auth.get_auth(request), 'some_user')
+
+            # The second policy found the ticket validated by the first
+            self.assertEqual(shared.hits, 1)
+            self.assertEqual(policies[1]._cache.local.hits, 0)
+            shared.close()
+
+    def test_shared_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache')
+            cache = SharedCache(path, capacity=8, value_size=32)
+            other = SharedCache(path, capacity=8, value_size=32)
+
+            cache.set('key', ('value', None), 10)
+            self.assertEqual(other.get('key'), ('value', None))
+            self.assertEqual(other.get_entry('missing'), None)
+
+            # Values too large to store, and expired entries, are not cached
+            cache.set('large', 'x' * 100, 10)
+            cache.set('expired', 'value', 0)
+            self.assertIs(other.get('large', None), None)
+            self.assertIs(other.get('expired', None), None)
+
+            other.pop('key')
+            self.assertIs(cache.get('key', None), None)
+
+            # Every key competes for the same 8 slots
+            for i in range(20):
+                cache.set(i, i, 10)
+            self.assertEqual(cache.evictions, 12)
+            self.assertEqual(cache.get(19), 19)
+
+            cache.clear()
+            self.assertIs(other.get(19, None), None)
+
+            with self.assertRaises(ValueError):
+                SharedCache(path, capacity=16, value_size=32)
+            self.assertIsNone(open_shared_cache(path, capacity=16))
+            self.assertIsNone(open_shared_cache(
+                os.path.join(directory, 'missing', 'cache')))
+
+            cache.close()
+            other.close()
+
+    def test_shared_cache_values_and_corrupt_entries(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = SharedCache(os.path.join(directory, 'cache'),
+                                capacity=8, value_size=64)
+
+            # Sequences are returned as tuples, unsupported values not stored
+            cache.set('groups', ['group0', Group.Everyone, 1, True], 10)
+            self.assertEqual(cache.get('groups'),
+                             ('group0', Group.Everyone, 1, True))
+            cache.set('object', object(), 10)
+            self.assertIs(cache.get('object', None), None)
+
+            # Corrupt values are treated as a miss
+            for offset in cache._window(cache._digest('groups')):
+                start = offset + cache._SLOT.size
+                cache._map[start:start + 4] = b'\xff{[x'
+            self.assertIs(cache.get('groups', None), None)
+            cache.close()
+
+    def test_shared_cache_rejects_foreign_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache')
+            with open(path, 'wb'):
+                pass
+            os.chmod(path, 0o644)
+
+            with self.assertRaises(PermissionError):
+                SharedCache(path, capacity=8)
+            self.assertIsNone(open_shared_cache(path, capacity=8))
+
+            os.chmod(path, 0o600)
+            SharedCache(path, capacity=8).close()
+
+    def test_token_buckets(self):
+        now = [0]
+        buckets = auth.TokenBuckets(1, 2, width=16, clock=lambda: now[0])
+
+        self.assertTrue(buckets.consume('key'))
+        self.assertTrue(buckets.consume('key'))
+        self.assertFalse(buckets.consume('key'))
+        self.assertEqual(buckets.retry_after('key'), 1)
+        self.assertEqual(buckets.tokens('other'), 2)
+
+        now[0] = 1.5
+        self.assertEqual(buckets.tokens('key'), 1.5)
+        self.assertTrue(buckets.consume('key'))
+
+    @asyncio.run_until_complete()
+    async def test_middleware_rate_limits_forged_tickets(self):
+        secret = b'01234567890abcdef'
+        auth_ = auth.CookieTktAuthentication(secret, 15, cookie_name='auth')
+        middlewares = [
+            auth_middleware(auth_, rate_limiter=auth.RateLimiter(ip_burst=2))]
+
+        session_data = TicketFactory(b'fedcba09876543210').new('some_user')
+        for i in range(2):
+            request = await make_request('GET', '/', middlewares, \
+                [(auth_.cookie_name, session_data)], peer='10.0.0.1')
+            self.assertIsNone(await auth.get_auth(request))
+
+        # Rejected before the ticket is validated
+        with self.assertRaises(web.HTTPTooManyRequests) as context:
+            await make_request('GET', '/', middlewares, \
+                [(auth_.cookie_name, session_data)], peer='10.0.0.1')
+        self.assertEqual(context.exception.headers['Retry-After'], '1')
+
+        # Other clients are not affected
+        request = await make_request('GET', '/', middlewares, \
+            [(auth_.cookie_name, session_data)], peer='10.0.0.2')
+        self.assertIsNone(await auth.get_auth(request))
+
+    @asyncio.run_until_complete()
+    async def test_middleware_rate_limiter_spares_stale_clients(self):
+        secret = b'01234567890abcdef'
+        auth_ = auth.CookieTktAuthentication(secret, 15, cookie_name='auth')
+        middlewares = [
+            auth_middleware(auth_, rate_limiter=auth.RateLimiter(ip_burst=2),
+                            login_routes=('login',))]
+
+        # A stale ticket is deleted from the client when it fails
+        session_data = TicketFactory(b'fedcba09876543210').new('some_user')
+        request = await make_request('GET', '/', middlewares, \
+            [(auth_.cookie_name, session_data)], peer='10.0.0.1')
+        self.assertIsNone(await auth.get_auth(request))
+        response = await make_response(request, middlewares)
+        self.assertEqual(response.cookies[auth_.cookie_name].value, '')
+
+        request = await make_request('GET', '/', middlewares, \
+            [(auth_.cookie_name, session_data)], peer='10.0.0.1')
+        self.assertIsNone(await auth.get_auth(request))
+        with self.assertRaises(web.HTTPTooManyRequests):
+            await make_request('GET', '/', middlewares, \
+                [(auth_.cookie_name, session_data)], peer='10.0.0.1')
+
+        # Requests without a ticket from the same address are not rejected
+        request = await make_request('GET', '/', middlewares, \
+            peer='10.0.0.1')
+        self.assertIsNone(await auth.get_auth(request))
+
+        # The login route is never rejected by the middleware
+        login = SimpleNamespace(route=SimpleNamespace(name='login'))
+        request = await make_request('POST', '/login', middlewares, \
+            [(auth_.cookie_name, session_data)], peer='10.0.0.1', \
+            match_info=login)
+        auth.check_rate_limit(request, 'some_user')
+        await auth.remember(request, 'some_user')
+
+    def test_rate_limiter_client_ip(self):
+        rate_limiter = auth.RateLimiter(
+            ip_burst=1, client_ip=lambda request: request.client)
+        clients = [SimpleNamespace(client='10.0.0.1', transport=None),
+                   SimpleNamespace(client='10.0.0.2', transport=None)]
+
+        rate_limiter.record_ticket_failure(clients[0])
+        self.assertIsNotNone(rate_limiter.ticket_retry_after(clients[0]))
+        self.assertIsNone(rate_limiter.ticket_retry_after(clients[1]))
+        self.assertIsNone(rate_limiter.retry_after(clients[0]))
+
+    @asyncio.run_until_complete()
+    async def test_middleware_rate_limits_failed_logins(self):
+        secret = b'01234567890abcdef'
+        auth_ = auth.CookieTktAuthentication(secret, 15, cookie_name='auth')
+        rate_limiter = auth.RateLimiter(user_burst=2)
+        middlewares = [
+            auth_middleware(auth_, rate_limiter=rate_limiter)]
+
+        request = await make_request('GET', '/', middlewares)
+        for i in range(2):
+            auth.check_rate_limit(request, 'some_user')
+            auth.record_failure(request, 'some_user')
+
+        with self.assertRaises(web.HTTPTooManyRequests):
+            auth.check_rate_limit(request, 'some_user')
+        auth.check_rate_limit(request, 'other_user')
+
+    @asyncio.run_until_complete()
+    async def test_new_style_middleware(self):
+        secret = b'01234567890abcdef'
+        auth_ = auth.CookieTktAuthentication(secret, 15, 0, cookie_name='auth')
+        middlewares = [
+            auth_middleware(auth_, new_style=True)]
+        self.assertEqual(middlewares[0].__middleware_version__, 1)
+
+        valid_until = time.time() + 15
+        session_data = TicketFactory(secret).new('some_user',
+                                                 valid_until=valid_until)
+        request = await make_request('GET', '/', middlewares, \
+            [(auth_.cookie_name, session_data)])
+
+        user_id = await auth.get_auth(request)
+        self.assertEqual(user_id, 'some_user')
+
+        response = await make_response(request, middlewares)
+        self.assertTrue(auth_.cookie_name in response.cookies)
+
+        await auth.forget(request)
+        self.assertIsNone(await auth.get_auth(request))
+        await auth.remember(request, 'other_user')
+        self.assertEqual(await auth.get_auth(request), 'other_user')
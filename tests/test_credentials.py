@@ -0,0 +1,96 @@
+import hashlib
+import unittest
+from asyncio import gather
+from aiohttp_auth.credentials import PasswordHasher, CredentialsBusyError
+from .util import asyncio
+
+
+class PasswordHasherTests(unittest.TestCase):
+
+    @asyncio.run_until_complete()
+    async def test_hash_and_verify(self):
+        hashers = [PasswordHasher(iterations=1000)]
+        # scrypt is only available when Python is built with OpenSSL 1.1+
+        if hasattr(hashlib, 'scrypt'):
+            hashers.append(PasswordHasher('scrypt', scrypt_n=2 ** 8))
+
+        for hasher in hashers:
+            encoded = await hasher.hash('password')
+            self.assertTrue(encoded.startswith(hasher._algorithm + '$'))
+            self.assertTrue(await hasher.verify('password', encoded))
+            self.assertFalse(await hasher.verify('Password', encoded))
+            self.assertNotEqual(encoded, await hasher.hash('password'))
+            hasher.close()
+
+    @asyncio.run_until_complete()
+    async def test_verify_fast_rejects(self):
+        hasher = PasswordHasher(iterations=1000, max_password_length=8)
+        encoded = await hasher.hash('password')
+
+        self.assertFalse(await hasher.verify('password', None))
+        self.assertFalse(await hasher.verify('', encoded))
+        self.assertFalse(await hasher.verify('password0', encoded))
+        self.assertFalse(await hasher.verify('password', 'md5$abc$def'))
+        self.assertFalse(
+            await hasher.verify('password', 'pbkdf2_sha256$x$a$b'))
+        self.assertFalse(await hasher.verify('password', encoded + '$0'))
+        hasher.close()
+
+    @asyncio.run_until_complete()
+    async def test_verify_rejects_invalid_parameters(self):
+        hasher = PasswordHasher(iterations=1000)
+        encoded = await hasher.hash('password')
+        salt, key = encoded.split('$')[-2:]
+
+        for params in ('1000$8$1', '256$0$1', '256$8$0', '256$8$17',
+                       '{}$8$1'.format(2 ** 20), '256${}$1'.format(2 ** 20)):
+            self.assertFalse(await hasher.verify(
+                'password', '$'.join(('scrypt', params, salt, key))))
+        self.assertFalse(await hasher.verify(
+            'password', 'pbkdf2_sha256${}${}${}'.format(10 ** 8, salt, key)))
+        self.assertEqual(hasher.pending, 0)
+        hasher.close()
+
+        with self.assertRaises(ValueError):
+            PasswordHasher('scrypt', scrypt_n=1000)
+        with self.assertRaises(ValueError):
+            PasswordHasher(iterations=0)
+
+    @asyncio.run_until_complete()
+    async def test_verify_unknown_user_against_dummy_hash(self):
+        hasher = PasswordHasher(iterations=1000)
+        self.assertFalse(hasher.needs_rehash(hasher.dummy_hash))
+        self.assertFalse(await hasher.verify('password', hasher.dummy_hash))
+        self.assertFalse(await hasher.verify('password', None))
+        hasher.close()
+
+    @asyncio.run_until_complete()
+    async def test_needs_rehash(self):
+        hasher = PasswordHasher(iterations=1000)
+        encoded = await hasher.hash('password')
+        self.assertFalse(hasher.needs_rehash(encoded))
+        self.assertTrue(PasswordHasher(iterations=2000).needs_rehash(encoded))
+        self.assertTrue(PasswordHasher('scrypt').needs_rehash(encoded))
+
+        # Hashes from other algorithms can still be verified
+        scrypt = PasswordHasher('scrypt', scrypt_n=2 ** 8)
+        self.assertTrue(await scrypt.verify('password', encoded))
+        hasher.close()
+        scrypt.close()
+
+    @asyncio.run_until_complete()
+    async def test_bounded_queue(self):
+        hasher = PasswordHasher(iterations=1000, max_concurrency=1,
+                                max_queue=2)
+        encoded = await hasher.hash('password')
+
+        # The order gather() starts the calls in varies between Python
+        # versions, so only count the results
+        results = await gather(
+            *[hasher.verify('password', encoded) for i in range(4)],
+            return_exceptions=True)
+        self.assertEqual(results.count(True), 3)
+        self.assertEqual(len([r for r in results
+                              if isinstance(r, CredentialsBusyError)]), 1)
+        self.assertEqual(hasher.pending, 0)
+        hasher.close()
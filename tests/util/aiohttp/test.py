@@ -1,4 +1,5 @@
 import asyncio
+from functools import partial
 from aiohttp import web, protocol
 from aiohttp.multidict import CIMultiDict
 from aiohttp.streams import EmptyStreamReader
@@ -11,20 +12,31 @@ def _identity(response):
 
     return handler
 
-async def prepare_request(request, middlewares):
+async def prepare_request(request, middlewares, app=None):
     """Mainly used in testing, passes the request through the middlewares to
     much like the aiohttp application does, to shortcut the need for a aiohttp
     application object when testing
     """
-    handler = _identity(web.Response())
-    for factory in reversed(middlewares):
-        handler = await factory(None, handler)
+    handler = await _chain(middlewares, app, _identity(web.Response()))
     response = await handler(request)
 
     return request
 
 
-async def make_request(method, path, middlewares, cookies=None):
+class _Transport(object):
+
+    def __init__(self, peer):
+        self._peer = peer
+
+    def get_extra_info(self, name, default=None):
+        if name == 'peername' and self._peer is not None:
+            return (self._peer, 12345)
+
+        return default
+
+
+async def make_request(method, path, middlewares, cookies=None, app=None,
+                       peer=None, match_info=None):
     headers = CIMultiDict()
     if cookies:
         for key, value in cookies:
@@ -32,10 +44,17 @@ async def make_request(method, path, middlewares, cookies=None):
 
     message = protocol.RawRequestMessage(method, path, protocol.HttpVersion11,
                                          headers, True, False)
-    request = web.Request({}, message, EmptyStreamReader(), None, None, None)
+    # aiohttp reads the transport to build request.path, so every request
+    # has one, with an unknown peer address unless one is passed
+    transport = _Transport(peer)
+    request = web.Request({}, message, EmptyStreamReader(), transport, None,
+                          None)
+    if match_info is not None:
+        # Set by the application when the request is routed
+        request._match_info = match_info
 
     if middlewares:
-        return await prepare_request(request, middlewares)
+        return await prepare_request(request, middlewares, app)
 
     return request
 
@@ -44,13 +63,22 @@ async def make_response(request, middlewares, response=None):
     if response is None:
         response = web.Response()
 
-    handler = _identity(response)
-    for factory in reversed(middlewares):
-        handler = await factory(None, handler)
-
+    handler = await _chain(middlewares, None, _identity(response))
     return await handler(request)
 
 
+async def _chain(middlewares, app, handler):
+    """Builds the handler chain like the aiohttp application does, for both
+    middleware factories and new style middlewares"""
+    for middleware in reversed(middlewares):
+        if getattr(middleware, '__middleware_version__', None) == 1:
+            handler = partial(middleware, handler=handler)
+        else:
+            handler = await middleware(app, handler)
+
+    return handler
+
+
 def make_auth_session(secret, user_id, cookie_name):
     from ticket_auth import TicketFactory
     import time